@@ -0,0 +1,17 @@
+# Generated manually to add the FEFO lookup index on Lote
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0013_add_preferencia_usuario_vencidos'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lote',
+            index=models.Index(fields=['id_insumo', 'cantidad_actual', 'fecha_vencimiento', 'fecha_ingreso'], name='lote_insumo_fefo_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated manually to add the consumption-window index on DetalleProduccionInsumo
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventario', '0014_add_lote_fefo_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='detalleproduccioninsumo',
+            index=models.Index(fields=['fecha_uso', 'id_insumo', 'cantidad_usada'], name='dpi_fecha_insumo_cant_idx'),
+        ),
+    ]
@@ -146,6 +146,10 @@ class Lote(models.Model):
         verbose_name = "Lote"
         verbose_name_plural = "Lotes"
         ordering = ['fecha_vencimiento', 'fecha_ingreso']
+        indexes = [
+            # Búsquedas FEFO por insumo con stock disponible
+            models.Index(fields=['id_insumo', 'cantidad_actual', 'fecha_vencimiento', 'fecha_ingreso'], name='lote_insumo_fefo_idx'),
+        ]
     
     def __str__(self):
         return f"Lote {self.numero_lote} - {self.id_insumo.nombre_insumo} (Vence: {self.fecha_vencimiento})"
@@ -214,6 +218,10 @@ class DetalleProduccionInsumo(models.Model):
         verbose_name = "Detalle de Producción de Insumo"
         verbose_name_plural = "Detalles de Producción de Insumos"
         ordering = ['-fecha_uso']
+        indexes = [
+            # Consumo por insumo en una ventana de fechas, resuelto solo con el índice
+            models.Index(fields=['fecha_uso', 'id_insumo', 'cantidad_usada'], name='dpi_fecha_insumo_cant_idx'),
+        ]
     
     def __str__(self):
         return f"{self.id_plato_producido.id_plato.nombre_plato} - {self.id_insumo.nombre_insumo} ({self.cantidad_usada} {self.id_insumo.unidad_medida})"
@@ -3,10 +3,11 @@ Comando para generar datos históricos de consumo de insumos para ML
 """
 from django.core.management.base import BaseCommand
 from django.utils import timezone
+from django.db import transaction
 from datetime import datetime, timedelta, date
 from inventario.models import (
     Insumo, Plato, DetalleProduccionInsumo, 
-    PlatoProducido, Receta, Ubicacion, Lote
+    PlatoProducido, Receta, Ubicacion, Lote, DetalleCompra
 )
 from django.contrib.auth.models import User
 import random
@@ -23,40 +24,35 @@ class Command(BaseCommand):
             help='Numero de dias de datos historicos a generar'
         )
 
+    @transaction.atomic
     def handle(self, *args, **options):
         dias = options['dias']
         
-        insumos = Insumo.objects.all()
-        platos = Plato.objects.all()
+        platos = list(Plato.objects.all())
         
-        if not insumos.exists():
+        if not Insumo.objects.exists():
             self.stdout.write(self.style.ERROR('No hay insumos en el sistema'))
             return
         
-        if not platos.exists():
+        if not platos:
             self.stdout.write(self.style.ERROR('No hay platos en el sistema'))
             return
         
-        # Obtener ubicación y usuario por defecto
-        try:
-            ubicacion = Ubicacion.objects.first()
-            if not ubicacion:
-                self.stdout.write(self.style.ERROR('No hay ubicaciones en el sistema'))
-                return
-        except:
-            self.stdout.write(self.style.ERROR('Error al obtener ubicacion'))
+        # Obtener ubicación, usuario y detalle de compra por defecto (una sola vez)
+        ubicacion = Ubicacion.objects.first()
+        if not ubicacion:
+            self.stdout.write(self.style.ERROR('No hay ubicaciones en el sistema'))
             return
         
-        try:
-            usuario = User.objects.first()
-            if not usuario:
-                self.stdout.write(self.style.ERROR('No hay usuarios en el sistema'))
-                return
-        except:
-            self.stdout.write(self.style.ERROR('Error al obtener usuario'))
+        usuario = User.objects.first()
+        if not usuario:
+            self.stdout.write(self.style.ERROR('No hay usuarios en el sistema'))
             return
         
+        detalle_compra = DetalleCompra.objects.first()
+        
         hoy = date.today()
+        tz = timezone.get_current_timezone()
         fecha_inicio = hoy - timedelta(days=dias)
         consumos_creados = 0
         platos_creados = 0
@@ -69,8 +65,7 @@ class Command(BaseCommand):
         # Producir TODOS los platos cada día para maximizar el uso de insumos
         for dia in range(dias):
             fecha_actual = fecha_inicio + timedelta(days=dia)
-            fecha_dt = datetime.combine(fecha_actual, datetime.min.time())
-            fecha_dt = timezone.make_aware(fecha_dt)
+            fecha_dt = datetime(fecha_actual.year, fecha_actual.month, fecha_actual.day, tzinfo=tz)
             
             # Producir TODOS los platos que tengan recetas para maximizar uso de insumos
             platos_con_receta = [p for p in platos if Receta.objects.filter(id_plato=p).exists()]
@@ -80,81 +75,65 @@ class Command(BaseCommand):
                 veces_producir = random.randint(1, 3)
                 
                 for _ in range(veces_producir):
-                
-                    try:
-                        # Receta es directamente la relación plato-insumo
-                        recetas = Receta.objects.filter(id_plato=plato)
+                    # Receta es directamente la relación plato-insumo
+                    recetas = Receta.objects.filter(id_plato=plato)
+                    
+                    if not recetas.exists():
+                        continue
+                    
+                    # Crear plato producido
+                    plato_producido = PlatoProducido.objects.create(
+                        estado='venta',
+                        fecha_produccion=fecha_dt,
+                        fecha_entrega=fecha_dt + timedelta(hours=1),
+                        id_plato=plato,
+                        id_ubicacion=ubicacion,
+                        id_usuario=usuario
+                    )
+                    platos_creados += 1
+                    
+                    # Crear consumo de insumos según la receta
+                    for receta in recetas:
+                        cantidad = float(receta.cantidad_necesaria)
+                        # Variar la cantidad ligeramente para simular variabilidad real
+                        cantidad_variada = cantidad * random.uniform(0.9, 1.1)
                         
-                        if not recetas.exists():
-                            continue
+                        # Necesitamos un lote para el DetalleProduccionInsumo
+                        # Buscar un lote existente del insumo
+                        lote = Lote.objects.filter(
+                            id_insumo=receta.id_insumo,
+                            cantidad_actual__gt=0
+                        ).only('id_lote', 'id_insumo').first()
                         
-                        # Crear plato producido
-                        plato_producido = PlatoProducido.objects.create(
-                            estado='venta',
-                            fecha_produccion=fecha_dt,
-                            fecha_entrega=fecha_dt + timedelta(hours=1),
-                            id_plato=plato,
-                            id_ubicacion=ubicacion,
-                            id_usuario=usuario
-                        )
-                        platos_creados += 1
-                        
-                        # Crear consumo de insumos según la receta
-                        for receta in recetas:
-                            cantidad = float(receta.cantidad_necesaria)
-                            # Variar la cantidad ligeramente para simular variabilidad real
-                            cantidad_variada = cantidad * random.uniform(0.9, 1.1)
-                            
-                            # Necesitamos un lote para el DetalleProduccionInsumo
-                            # Buscar un lote existente del insumo
-                            lote = None
-                            try:
-                                lote = Lote.objects.filter(
-                                    id_insumo=receta.id_insumo,
-                                    cantidad_actual__gt=0
-                                ).first()
-                            except:
-                                pass
-                            
-                            # Si no hay lote, intentar crear uno temporal
-                            if not lote:
-                                try:
-                                    from inventario.models import DetalleCompra
-                                    detalle_compra = DetalleCompra.objects.first()
-                                    if detalle_compra:
-                                        lote = Lote.objects.create(
-                                            id_detalle_compra=detalle_compra,
-                                            id_insumo=receta.id_insumo,
-                                            id_ubicacion=ubicacion,
-                                            costo_unitario=1000,
-                                            fecha_vencimiento=hoy + timedelta(days=30),
-                                            fecha_ingreso=fecha_actual,
-                                            cantidad_actual=1000,
-                                            numero_lote=f'TEMP-{receta.id_insumo.id_insumo}-{dia}'
-                                        )
-                                except Exception as e:
-                                    self.stdout.write(
-                                        self.style.WARNING(
-                                            f'No se pudo crear lote para {receta.id_insumo.nombre_insumo}: {e}'
-                                        )
+                        # Si no hay lote, crear uno temporal
+                        if not lote:
+                            if not detalle_compra:
+                                self.stdout.write(
+                                    self.style.WARNING(
+                                        f'No se pudo crear lote para {receta.id_insumo.nombre_insumo}: '
+                                        f'no hay detalles de compra'
                                     )
-                                    continue
-                            
-                            if lote:
-                                DetalleProduccionInsumo.objects.create(
-                                    id_plato_producido=plato_producido,
-                                    id_lote=lote,
-                                    id_insumo=receta.id_insumo,
-                                    cantidad_usada=cantidad_variada,
-                                    fecha_uso=fecha_dt
                                 )
-                                consumos_creados += 1
-                            
-                    except Exception as e:
-                        self.stdout.write(
-                            self.style.WARNING(f'Error al procesar plato {plato.nombre_plato}: {e}')
+                                continue
+                            lote = Lote.objects.create(
+                                id_detalle_compra=detalle_compra,
+                                id_insumo=receta.id_insumo,
+                                id_ubicacion=ubicacion,
+                                costo_unitario=1000,
+                                fecha_vencimiento=hoy + timedelta(days=30),
+                                fecha_ingreso=fecha_actual,
+                                cantidad_actual=1000,
+                                numero_lote=f'TEMP-{receta.id_insumo.id_insumo}-{dia}'
+                            )
+                        
+                        DetalleProduccionInsumo.objects.create(
+                            id_plato_producido=plato_producido,
+                            id_lote=lote,
+                            id_insumo=receta.id_insumo,
+                            cantidad_usada=cantidad_variada,
+                            fecha_uso=fecha_dt
                         )
-                        continue
+                        consumos_creados += 1
         
         self.stdout.write(
             self.style.SUCCESS(
@@ -4,7 +4,7 @@ Incluye: Compras -> Lotes -> Producción -> Ventas
 """
 from django.core.management.base import BaseCommand
 from django.utils import timezone
-from django.db import transaction
+from django.db import reset_queries, transaction
 from datetime import datetime, timedelta, date
 from decimal import Decimal
 from inventario.models import (
@@ -14,11 +14,28 @@ from inventario.models import (
     MovimientoStock, Usuario, RegistroVentaPlato
 )
 from django.contrib.auth.models import User
+from collections import Counter
+import gc
+import numpy as np
 import random
 
+# Tamaño de lote para las inserciones masivas (bulk_create)
+BATCH_SIZE = 1000
 
-def generar_numero_lote(insumo, fecha_ingreso):
-    """Genera un número de lote basado en el código del insumo y fecha"""
+# Filas acumuladas en memoria antes de volcar un buffer a la BD
+CHUNK = 5000
+
+# Columnas de Lote que usa la búsqueda FIFO (el resto no se transfiere)
+CAMPOS_LOTE_FIFO = ('id_lote', 'cantidad_actual', 'id_insumo', 'fecha_vencimiento', 'fecha_ingreso')
+
+
+def generar_numero_lote(insumo, fecha_ingreso, contadores):
+    """Genera un número de lote basado en el código del insumo y fecha
+    
+    `contadores` guarda el último correlativo usado por (insumo, año-mes): la BD
+    solo se consulta la primera vez que aparece cada combinación; después el
+    comando es el único que inserta lotes y el siguiente número sale de memoria.
+    """
     if not insumo.codigo:
         codigo_insumo = insumo.nombre_insumo[:3].upper()
     else:
@@ -26,25 +43,42 @@ def generar_numero_lote(insumo, fecha_ingreso):
     
     # Usar año y mes en el número de lote
     año_mes = fecha_ingreso.strftime('%Y%m')
+    prefijo = f'{codigo_insumo}-{año_mes}-'
+    clave = (insumo.id_insumo, prefijo)
     
-    # Buscar lotes existentes con este patrón
-    lotes_existentes = Lote.objects.filter(
-        id_insumo=insumo,
-        numero_lote__startswith=f'{codigo_insumo}-{año_mes}-'
-    )
-    
-    numeros_existentes = []
-    for lote in lotes_existentes:
-        try:
-            partes = lote.numero_lote.split('-')
-            if len(partes) >= 3:
-                numero = int(partes[2])
-                numeros_existentes.append(numero)
-        except (ValueError, IndexError):
-            continue
+    if clave not in contadores:
+        # Buscar lotes existentes con este patrón
+        lotes_existentes = Lote.objects.filter(
+            id_insumo=insumo,
+            numero_lote__startswith=prefijo
+        ).values_list('numero_lote', flat=True)
+        
+        numeros_existentes = []
+        for numero_lote in lotes_existentes:
+            try:
+                partes = numero_lote.split('-')
+                if len(partes) >= 3:
+                    numero = int(partes[2])
+                    numeros_existentes.append(numero)
+            except (ValueError, IndexError):
+                continue
+        
+        contadores[clave] = max(numeros_existentes) if numeros_existentes else 0
     
-    siguiente_numero = max(numeros_existentes) + 1 if numeros_existentes else 1
-    return f"{codigo_insumo}-{año_mes}-{siguiente_numero:02d}"
+    contadores[clave] += 1
+    return f"{prefijo}{contadores[clave]:02d}"
+
+
+def volcar_buffer(modelo, buf, minimo=1):
+    """Inserta el buffer con bulk_create si tiene al menos `minimo` filas y lo vacía"""
+    if len(buf) >= minimo:
+        modelo.objects.bulk_create(buf, batch_size=BATCH_SIZE)
+        buf.clear()
+
+
+def monto_aleatorio(minimo, maximo, u):
+    """Escala un valor uniforme u en [0, 1) a un monto con 2 decimales (vía centavos enteros)"""
+    return Decimal(int((minimo + u * (maximo - minimo)) * 100)).scaleb(-2)
 
 
 class Command(BaseCommand):
@@ -83,26 +117,38 @@ class Command(BaseCommand):
         )
 
     def handle(self, *args, **options):
+        # fecha_produccion tiene auto_now_add=True: se desactiva mientras corre el
+        # comando para asignar la fecha histórica directamente en un único save()
+        campo_fecha = PlatoProducido._meta.get_field('fecha_produccion')
+        campo_fecha.auto_now_add = False
+        try:
+            # Una sola transacción: evita un commit (y su fsync) por cada insert
+            with transaction.atomic():
+                self._generar_datos(**options)
+        finally:
+            campo_fecha.auto_now_add = True
+
+    def _generar_datos(self, **options):
         año = options['ano']
         mes_inicio = options['mes_inicio']
         mes_fin = options['mes_fin']
         compras_por_mes = options['compras_por_mes']
         producciones_por_dia = options['producciones_por_dia']
         
-        # Validar datos básicos
-        insumos = Insumo.objects.all()
-        platos = Plato.objects.all()
-        proveedores = Proveedor.objects.all()
+        # Validar datos básicos (listas indexables: random.choice/sample no re-consultan)
+        insumos_list = list(Insumo.objects.all())
+        platos_list = list(Plato.objects.all())
+        proveedores = list(Proveedor.objects.all())
         
-        if not insumos.exists():
+        if not insumos_list:
             self.stdout.write(self.style.ERROR('No hay insumos en el sistema'))
             return
         
-        if not platos.exists():
+        if not platos_list:
             self.stdout.write(self.style.ERROR('No hay platos en el sistema'))
             return
         
-        if not proveedores.exists():
+        if not proveedores:
             self.stdout.write(self.style.ERROR('No hay proveedores en el sistema'))
             return
         
@@ -129,6 +175,14 @@ class Command(BaseCommand):
                 self.stdout.write(self.style.ERROR('No hay usuarios en la tabla USUARIO'))
                 return
         
+        n_insumos = len(insumos_list)
+        
+        # Los valores aleatorios de cada mes/día se generan en bloque con NumPy
+        rng = np.random.default_rng()
+        tz = timezone.get_current_timezone()
+        recetas_por_plato = Counter(Receta.objects.values_list('id_plato_id', flat=True))
+        max_ingredientes = max(recetas_por_plato.values(), default=0)
+        
         self.stdout.write(f'Generando datos históricos para {año} (meses {mes_inicio}-{mes_fin})...')
         self.stdout.write(f'Producciones por día: {producciones_por_dia} (equilibrado)')
         
@@ -137,6 +191,21 @@ class Command(BaseCommand):
         platos_producidos = 0
         ventas_creadas = 0
         
+        # Detalles de producción, movimientos de stock y ventas acumulados en memoria;
+        # se vuelcan con bulk_create cada CHUNK filas y al final del comando
+        detalles_buf = []
+        movimientos_buf = []
+        ventas_buf = []
+        
+        # Lotes FIFO cargados en el día por insumo y lotes descontados (id_lote ->
+        # instancia). Las cantidades en memoria mandan sobre la BD hasta el
+        # bulk_update de fin de día.
+        lotes_por_insumo = {}
+        lotes_sucios = {}
+        
+        # Último correlativo de número de lote usado por (insumo, año-mes)
+        contadores_lote = {}
+        
         # Procesar mes por mes
         for mes in range(mes_inicio, mes_fin + 1):
             self.stdout.write(f'\n--- Procesando mes {mes}/{año} ---')
@@ -152,6 +221,9 @@ class Command(BaseCommand):
             # Crear compras distribuidas en el mes
             dias_entre_compras = max(1, dias_en_mes // compras_por_mes)
             
+            # Hasta 8 insumos por orden, 2 valores (cantidad y costo) por insumo
+            uniformes = iter(rng.random(compras_por_mes * 8 * 2).tolist())
+            
             for compra_num in range(compras_por_mes):
                 dia_compra = min(1 + (compra_num * dias_entre_compras), dias_en_mes)
                 fecha_compra = date(año, mes, dia_compra)
@@ -168,20 +240,20 @@ class Command(BaseCommand):
                 ordenes_creadas += 1
                 
                 # Crear detalles de compra (3-8 insumos por orden)
-                num_insumos = random.randint(3, min(8, insumos.count()))
-                insumos_orden = random.sample(list(insumos), num_insumos)
+                num_insumos = random.randint(3, min(8, n_insumos))
+                insumos_orden = random.sample(insumos_list, num_insumos)
                 
                 for insumo in insumos_orden:
                     # Cantidad y costo realistas según el insumo
                     if 'kg' in insumo.unidad_medida.lower():
-                        cantidad = Decimal(random.uniform(50, 200)).quantize(Decimal('0.01'))  # Más cantidad para tener stock
-                        costo = Decimal(random.uniform(500, 5000)).quantize(Decimal('0.01'))
+                        cantidad = monto_aleatorio(50, 200, next(uniformes))  # Más cantidad para tener stock
+                        costo = monto_aleatorio(500, 5000, next(uniformes))
                     elif 'und' in insumo.unidad_medida.lower() or 'unidad' in insumo.unidad_medida.lower():
-                        cantidad = Decimal(random.uniform(50, 300)).quantize(Decimal('0.01'))  # Más cantidad
-                        costo = Decimal(random.uniform(100, 2000)).quantize(Decimal('0.01'))
+                        cantidad = monto_aleatorio(50, 300, next(uniformes))  # Más cantidad
+                        costo = monto_aleatorio(100, 2000, next(uniformes))
                     else:
-                        cantidad = Decimal(random.uniform(20, 100)).quantize(Decimal('0.01'))  # Más cantidad
-                        costo = Decimal(random.uniform(300, 3000)).quantize(Decimal('0.01'))
+                        cantidad = monto_aleatorio(20, 100, next(uniformes))  # Más cantidad
+                        costo = monto_aleatorio(300, 3000, next(uniformes))
                     
                     # Crear detalle de compra
                     detalle_compra = DetalleCompra.objects.create(
@@ -195,7 +267,7 @@ class Command(BaseCommand):
                     fecha_recepcion = fecha_compra + timedelta(days=random.randint(2, 5))
                     fecha_vencimiento = fecha_recepcion + timedelta(days=random.randint(60, 120))  # Más días de vencimiento
                     
-                    numero_lote = generar_numero_lote(insumo, fecha_recepcion)
+                    numero_lote = generar_numero_lote(insumo, fecha_recepcion, contadores_lote)
                     
                     lote = Lote.objects.create(
                         id_detalle_compra=detalle_compra,
@@ -210,18 +282,18 @@ class Command(BaseCommand):
                     lotes_creados += 1
                     
                     # 3. CREAR MOVIMIENTO DE STOCK (entrada por compra)
-                    MovimientoStock.objects.create(
+                    movimientos_buf.append(MovimientoStock(
                         id_lote=lote,
                         id_usuario=usuario,
                         fecha_movimiento=fecha_recepcion,
                         tipo_movimiento='entrada',
                         origen_movimiento='compra',
                         cantidad=cantidad
-                    )
+                    ))
             
             # 4. CREAR PRODUCCIÓN Y VENTAS (distribuidas durante el mes)
             # Producir platos 5-6 días por semana
-            platos_con_receta = [p for p in platos if Receta.objects.filter(id_plato=p).exists()]
+            platos_con_receta = [p for p in platos_list if Receta.objects.filter(id_plato=p).exists()]
             
             if not platos_con_receta:
                 self.stdout.write(self.style.WARNING(f'No hay platos con recetas en el mes {mes}'))
@@ -251,34 +323,45 @@ class Command(BaseCommand):
                         int(producciones_por_dia * 1.2)
                     )
                 
+                # Valores aleatorios del día, consumidos por índice
+                elecciones = rng.integers(0, len(platos_con_receta), size=num_producciones).tolist()
+                horas = rng.integers(8, 21, size=num_producciones).tolist()
+                minutos = rng.integers(0, 60, size=num_producciones).tolist()
+                minutos_entrega = rng.integers(15, 46, size=num_producciones).tolist()
+                factores = iter(rng.uniform(0.95, 1.05, size=num_producciones * max_ingredientes).tolist())
+                
                 # Producir platos
-                for _ in range(num_producciones):
-                    plato = random.choice(platos_con_receta)
+                for i in range(num_producciones):
+                    plato = platos_con_receta[elecciones[i]]
                     recetas = Receta.objects.filter(id_plato=plato).select_related('id_insumo')
                     
                     if not recetas.exists():
                         continue
                     
                     # Hora de producción (distribuida durante el día)
-                    hora_produccion = random.randint(8, 20)
-                    fecha_produccion = datetime.combine(
-                        fecha_actual,
-                        datetime.min.time().replace(hour=hora_produccion, minute=random.randint(0, 59))
+                    fecha_produccion = datetime(
+                        fecha_actual.year, fecha_actual.month, fecha_actual.day,
+                        horas[i], minutos[i], tzinfo=tz
                     )
-                    fecha_produccion = timezone.make_aware(fecha_produccion)
                     
                     # Verificar que hay lotes disponibles para todos los ingredientes
                     lotes_disponibles = {}
                     puede_producir = True
                     
                     for receta in recetas:
-                        # Buscar lote disponible (FIFO por fecha de vencimiento)
-                        # Buscar en bodega primero, luego en cocina
-                        lote = Lote.objects.filter(
-                            id_insumo=receta.id_insumo,
-                            cantidad_actual__gt=0,
-                            fecha_ingreso__lte=fecha_actual
-                        ).order_by('fecha_vencimiento', 'fecha_ingreso').first()
+                        # Lotes del insumo en orden FIFO por fecha de vencimiento: se cargan
+                        # una vez por día y luego se recorren en memoria
+                        lotes_fifo = lotes_por_insumo.get(receta.id_insumo_id)
+                        if lotes_fifo is None:
+                            lotes_fifo = list(Lote.objects.filter(
+                                id_insumo=receta.id_insumo_id,
+                                cantidad_actual__gt=0,
+                                fecha_ingreso__lte=fecha_actual
+                            ).only(*CAMPOS_LOTE_FIFO).order_by('fecha_vencimiento', 'fecha_ingreso'))
+                            lotes_por_insumo[receta.id_insumo_id] = lotes_fifo
+                        
+                        con_stock = (l for l in lotes_fifo if l.cantidad_actual > 0)
+                        lote = next(con_stock, None)
                         
                         if not lote:
                             puede_producir = False
@@ -286,15 +369,9 @@ class Command(BaseCommand):
                         
                         # Verificar que hay suficiente cantidad
                         if lote.cantidad_actual < receta.cantidad_necesaria:
-                            # Intentar buscar otro lote del mismo insumo
-                            lotes_alternativos = Lote.objects.filter(
-                                id_insumo=receta.id_insumo,
-                                cantidad_actual__gt=0,
-                                fecha_ingreso__lte=fecha_actual
-                            ).exclude(id_lote=lote.id_lote).order_by('fecha_vencimiento', 'fecha_ingreso')
-                            
+                            # Sumar los lotes siguientes del mismo insumo
                             cantidad_total = lote.cantidad_actual
-                            for lote_alt in lotes_alternativos:
+                            for lote_alt in con_stock:
                                 cantidad_total += lote_alt.cantidad_actual
                                 if cantidad_total >= receta.cantidad_necesaria:
                                     break
@@ -308,67 +385,80 @@ class Command(BaseCommand):
                     if not puede_producir:
                         continue
                     
-                    # Crear plato producido
-                    # IMPORTANTE: Usar save() con update_fields para evitar auto_now_add
+                    # Crear plato producido (auto_now_add desactivado en handle)
                     plato_producido = PlatoProducido(
                         id_plato=plato,
                         id_ubicacion=ubicacion_cocina,
                         estado='venta',  # Directamente vendido
-                        fecha_entrega=fecha_produccion + timedelta(minutes=random.randint(15, 45)),
+                        fecha_produccion=fecha_produccion,
+                        fecha_entrega=fecha_produccion + timedelta(minutes=minutos_entrega[i]),
                         id_usuario=usuario_django
                     )
-                    # Guardar primero sin fecha_produccion
                     plato_producido.save()
-                    # Luego actualizar la fecha_produccion manualmente
-                    PlatoProducido.objects.filter(id_plato_producido=plato_producido.id_plato_producido).update(
-                        fecha_produccion=fecha_produccion
-                    )
-                    plato_producido.refresh_from_db()
                     platos_producidos += 1
                     
                     # Crear detalles de producción y descontar lotes
                     for receta in recetas:
                         lote = lotes_disponibles[receta.id_insumo]
-                        cantidad_usada = receta.cantidad_necesaria
                         
-                        # Variar ligeramente la cantidad usada
-                        cantidad_usada = cantidad_usada * Decimal(random.uniform(0.95, 1.05))
-                        cantidad_usada = cantidad_usada.quantize(Decimal('0.01'))
+                        # Variar ligeramente la cantidad usada (en centavos enteros)
+                        centavos = int(receta.cantidad_necesaria * 100)
+                        cantidad_usada = Decimal(round(centavos * next(factores))).scaleb(-2)
                         
                         # Crear detalle de producción
-                        DetalleProduccionInsumo.objects.create(
+                        detalles_buf.append(DetalleProduccionInsumo(
                             id_plato_producido=plato_producido,
                             id_lote=lote,
                             id_insumo=receta.id_insumo,
                             cantidad_usada=cantidad_usada,
                             fecha_uso=fecha_produccion
-                        )
+                        ))
                         
                         # Descontar del lote
                         lote.cantidad_actual -= cantidad_usada
                         if lote.cantidad_actual < 0:
                             lote.cantidad_actual = Decimal('0')
-                        lote.save()
+                        lotes_sucios[lote.id_lote] = lote
                         
                         # Crear movimiento de stock (salida por producción)
-                        MovimientoStock.objects.create(
+                        movimientos_buf.append(MovimientoStock(
                             id_lote=lote,
                             id_usuario=usuario,
                             fecha_movimiento=fecha_actual,
                             tipo_movimiento='salida',
                             origen_movimiento='produccion',
                             cantidad=cantidad_usada
-                        )
+                        ))
                     
                     # Crear registro de venta con la MISMA fecha que la producción
                     # Esto asegura consistencia en las predicciones
                     fecha_venta = fecha_produccion.date()  # Usar la fecha exacta de producción
-                    RegistroVentaPlato.objects.create(
+                    ventas_buf.append(RegistroVentaPlato(
                         id_plato=plato,
                         fecha_venta=fecha_venta,
                         cantidad_vendida=1
-                    )
+                    ))
                     ventas_creadas += 1
+                
+                # Volcar los lotes descontados en el día con una sola operación
+                Lote.objects.bulk_update(lotes_sucios.values(), ['cantidad_actual'], batch_size=500)
+                lotes_sucios.clear()
+                lotes_por_insumo.clear()
+                
+                # Volcar los buffers que alcanzaron CHUNK filas
+                volcar_buffer(DetalleProduccionInsumo, detalles_buf, CHUNK)
+                volcar_buffer(MovimientoStock, movimientos_buf, CHUNK)
+                volcar_buffer(RegistroVentaPlato, ventas_buf, CHUNK)
+            
+            # Liberar el log de consultas (DEBUG=True) y los objetos del mes. La
+            # conexión no se cierra: todo el comando corre en una transacción.
+            reset_queries()
+            gc.collect()
+        
+        # Volcar el remanente de los buffers
+        volcar_buffer(DetalleProduccionInsumo, detalles_buf)
+        volcar_buffer(MovimientoStock, movimientos_buf)
+        volcar_buffer(RegistroVentaPlato, ventas_buf)
         
         self.stdout.write(self.style.SUCCESS('\n' + '='*60))
         self.stdout.write(self.style.SUCCESS(f'RESUMEN DE DATOS GENERADOS PARA {año}:'))
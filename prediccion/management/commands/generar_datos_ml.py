@@ -1,9 +1,49 @@
-import random
-from datetime import date, timedelta, datetime
+import numpy as np
+from datetime import date, timedelta
 from django.core.management.base import BaseCommand
 from inventario.models import Plato, PlatoProducido, Ubicacion
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.db import transaction
+
+# Intentar importar Numba (opcional: acelera el cálculo de cantidades diarias)
+try:
+    from numba import njit
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+    njit = None
+
+# Tamaño de lote para las inserciones masivas (bulk_create)
+BATCH_SIZE = 1000
+
+# Multiplicador de ventas por día de la semana (índice = weekday(), 0=Lunes):
+# - Lunes a Jueves: base normal
+# - Viernes: +30% (inicio de fin de semana)
+# - Sábado: +50% (día más ocupado)
+# - Domingo: +20% (día medio)
+MULTIPLICADOR_DIA_SEMANA = np.array([1.0, 1.0, 1.0, 1.0, 1.3, 1.5, 1.2])
+
+
+def _calcular_cantidades_kernel(multiplicador, base, variacion):
+    """Kernel por elementos de calcular_cantidades (se compila con Numba)"""
+    out = np.empty(base.shape, dtype=np.int32)
+    for d in range(base.shape[0]):
+        mult = multiplicador[d]
+        for p in range(base.shape[1]):
+            v = int(int(base[d, p] * mult) * variacion[d, p])
+            out[d, p] = v if v >= 1 else 1
+    return out
+
+
+if NUMBA_DISPONIBLE:
+    calcular_cantidades = njit(cache=True)(_calcular_cantidades_kernel)
+else:
+    def calcular_cantidades(multiplicador, base, variacion):
+        """Cantidad de ventas por (día, plato): base ajustada por día de semana y variación, mínimo 1"""
+        base = np.floor(base * multiplicador[:, None])
+        return np.maximum(1, (base * variacion).astype(np.int32))
+
 
 class Command(BaseCommand):
     help = 'Genera datos sintéticos de ventas históricas para entrenar el modelo ML (mínimo 365 días)'
@@ -27,8 +67,26 @@ class Command(BaseCommand):
             default=15,
             help='Ventas máximas por día por plato (default: 15)'
         )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Semilla para el generador aleatorio (default: ninguna, datos distintos en cada ejecución)'
+        )
 
     def handle(self, *args, **options):
+        # fecha_produccion tiene auto_now_add=True: se desactiva mientras corre el
+        # comando para que bulk_create respete la fecha asignada a cada venta
+        campo_fecha = PlatoProducido._meta.get_field('fecha_produccion')
+        campo_fecha.auto_now_add = False
+        try:
+            # Una sola transacción: un único commit para toda la generación
+            with transaction.atomic():
+                self._generar_datos(**options)
+        finally:
+            campo_fecha.auto_now_add = True
+
+    def _generar_datos(self, **options):
         dias = options['dias']
         ventas_min = options['ventas_min']
         ventas_max = options['ventas_max']
@@ -39,8 +97,8 @@ class Command(BaseCommand):
         self.stdout.write(f'Generando datos históricos ({dias} días)...')
         
         # Verificar que existan los datos necesarios
-        platos = Plato.objects.all()
-        if not platos.exists():
+        platos = list(Plato.objects.all())
+        if not platos:
             self.stdout.write(self.style.ERROR('No hay platos creados. Crea platos primero.'))
             return
         
@@ -63,81 +121,77 @@ class Command(BaseCommand):
         fecha_inicio = fecha_fin - timedelta(days=dias)
         
         total_creados = 0
-        fecha_actual = fecha_inicio
+        ventas_buf = []
         
         self.stdout.write(f'Rango de fechas: {fecha_inicio} a {fecha_fin}')
-        self.stdout.write(f'Platos a procesar: {platos.count()}')
+        self.stdout.write(f'Platos a procesar: {len(platos)}')
         self.stdout.write('')
 
-        while fecha_actual <= fecha_fin:
-            dia_semana = fecha_actual.weekday()  # 0=Lunes, 6=Domingo
-            es_fin_semana = dia_semana >= 5  # Sábado (5) y Domingo (6)
-            es_viernes = dia_semana == 4
-            
-            # Patrones de ventas más realistas:
-            # - Lunes a Jueves: base normal
-            # - Viernes: +30% (inicio de fin de semana)
-            # - Sábado: +50% (día más ocupado)
-            # - Domingo: +20% (día medio)
+        # Las cantidades de todos los días y platos se calculan de una vez con NumPy
+        rng = np.random.default_rng(options['seed'])
+        tz = timezone.get_current_timezone()
+        n_dias = (fecha_fin - fecha_inicio).days + 1
+        n_platos = len(platos)
+        dias_semana = (fecha_inicio.weekday() + np.arange(n_dias)) % 7  # 0=Lunes, 6=Domingo
+        multiplicador = MULTIPLICADOR_DIA_SEMANA[dias_semana]
+        
+        # Base de ventas diarias, ajustada según día de la semana y con variación
+        # aleatoria adicional (±20%)
+        base = rng.integers(ventas_min, ventas_max + 1, size=(n_dias, n_platos))
+        variacion = rng.uniform(0.8, 1.2, size=(n_dias, n_platos))
+        cantidades = calcular_cantidades(multiplicador, base, variacion)
+        
+        # Fecha y hora de cada venta (entre 12:00 y 22:59, horario de restaurante),
+        # en el mismo orden en que se recorren días y platos
+        total_ventas = int(cantidades.sum())
+        dia_de_venta = np.repeat(np.arange(n_dias * n_platos), cantidades.ravel()) // n_platos
+        segundos = (
+            rng.integers(12, 23, size=total_ventas) * 3600
+            + rng.integers(0, 60, size=total_ventas) * 60
+            + rng.integers(0, 60, size=total_ventas)
+        )
+        fechas_venta = iter((
+            np.datetime64(fecha_inicio, 's')
+            + dia_de_venta.astype('timedelta64[D]')
+            + segundos.astype('timedelta64[s]')
+        ).tolist())
+        cantidades = cantidades.tolist()
+        ultimo_tramo = -1
+
+        for d in range(n_dias):
+            fecha_actual = fecha_inicio + timedelta(days=d)
             
-            for plato in platos:
-                # Base de ventas diarias
-                cantidad_base = random.randint(ventas_min, ventas_max)
-                
-                # Ajustes según día de la semana
-                if es_fin_semana:
-                    if dia_semana == 5:  # Sábado
-                        cantidad_base = int(cantidad_base * 1.5)
-                    elif dia_semana == 6:  # Domingo
-                        cantidad_base = int(cantidad_base * 1.2)
-                elif es_viernes:
-                    cantidad_base = int(cantidad_base * 1.3)
-                
-                # Variación aleatoria adicional (±20%)
-                variacion = random.uniform(0.8, 1.2)
-                cantidad_base = max(1, int(cantidad_base * variacion))
-                
+            for j, plato in enumerate(platos):
                 # Simular ventas individuales a lo largo del día
-                for _ in range(cantidad_base):
-                    # Hora aleatoria entre 12:00 y 22:00 (horario de restaurante)
-                    hora = random.randint(12, 22)
-                    minuto = random.randint(0, 59)
-                    segundo = random.randint(0, 59)
-                    
-                    # Crear datetime con la fecha y hora
-                    fecha_venta = timezone.make_aware(
-                        datetime.combine(fecha_actual, datetime.min.time().replace(hour=hora, minute=minuto, second=segundo))
-                    )
+                for _ in range(cantidades[d][j]):
+                    fecha_venta = next(fechas_venta).replace(tzinfo=tz)
                     
-                    # Crear el plato producido
-                    plato_producido = PlatoProducido.objects.create(
+                    # Acumular el plato producido (se inserta con bulk_create al cerrar el día)
+                    ventas_buf.append(PlatoProducido(
                         id_plato=plato,
                         id_ubicacion=ubicacion,
                         id_usuario=usuario,
-                        estado='venta'
-                    )
-                    
-                    # Actualizar fecha_produccion manualmente (porque tiene auto_now_add=True)
-                    PlatoProducido.objects.filter(id_plato_producido=plato_producido.id_plato_producido).update(
+                        estado='venta',
                         fecha_produccion=fecha_venta
-                    )
-                    plato_producido.refresh_from_db()
+                    ))
                     
                     total_creados += 1
             
-            # Mostrar progreso cada 30 días
-            if (fecha_actual - fecha_inicio).days % 30 == 0:
-                progreso = ((fecha_actual - fecha_inicio).days / dias) * 100
-                self.stdout.write(f'Progreso: {progreso:.1f}% - Fecha: {fecha_actual} - Total creados: {total_creados}', ending='\r')
+            PlatoProducido.objects.bulk_create(ventas_buf, batch_size=BATCH_SIZE)
+            ventas_buf.clear()
             
-            fecha_actual += timedelta(days=1)
+            # Mostrar progreso solo al avanzar cada 10%
+            progreso = (d / dias) * 100
+            if int(progreso // 10) != ultimo_tramo:
+                ultimo_tramo = int(progreso // 10)
+                self.stdout.write(f'Progreso: {progreso:.1f}% - Fecha: {fecha_actual} - Total creados: {total_creados}', ending='\r')
 
         self.stdout.write('')  # Nueva línea después del progreso
         self.stdout.write(self.style.SUCCESS(
             f'\n[OK] ¡Listo! Se generaron {total_creados} registros de ventas.\n'
             f'   - Periodo: {fecha_inicio} a {fecha_fin} ({dias} dias)\n'
             f'   - Promedio: {total_creados / dias:.1f} ventas/dia\n'
-            f'   - Promedio por plato: {total_creados / (dias * platos.count()):.1f} ventas/dia/plato'
+            f'   - Promedio por plato: {total_creados / (dias * len(platos)):.1f} ventas/dia/plato'
         ))
         
         self.stdout.write(self.style.WARNING(
@@ -4,13 +4,42 @@ Elimina producción, ventas y registros relacionados manteniendo integridad refe
 """
 from django.core.management.base import BaseCommand
 from django.db import transaction
+from django.db.models import Q
 from datetime import date
+from itertools import islice
 from inventario.models import (
     PlatoProducido, DetalleProduccionInsumo, RegistroVentaPlato,
     MovimientoStock, Merma, Lote, DetalleCompra, OrdenCompra
 )
 from ventas.models import DetalleComanda, Comanda, MovimientoMesa
 
+# Pares (fecha, plato) combinados por consulta al filtrar ventas
+PARES_POR_CONSULTA = 500
+
+# Platos producidos eliminados por iteración (acota memoria y tamaño del IN)
+IDS_POR_LOTE = 10000
+
+# IDs por UPDATE al desvincular detalles de comanda
+IDS_POR_ACTUALIZACION = 1000
+
+
+def en_lotes(iterable, tamaño):
+    """Recorre `iterable` en listas de hasta `tamaño` elementos"""
+    it = iter(iterable)
+    while True:
+        lote = list(islice(it, tamaño))
+        if not lote:
+            return
+        yield lote
+
+
+def filtro_ventas(pares):
+    """Q que selecciona las ventas de cada par (fecha_venta, id_plato)"""
+    q = Q()
+    for fecha, plato_id in pares:
+        q |= Q(id_plato=plato_id, fecha_venta=fecha)
+    return q
+
 
 class Command(BaseCommand):
     help = 'Limpia todos los datos historicos de 2024 y 2025'
@@ -70,38 +99,34 @@ class Command(BaseCommand):
                     count_platos = platos.count()
                     
                     if count_platos > 0:
-                        # Obtener IDs antes de eliminar
-                        platos_ids = list(platos.values_list('id_plato_producido', flat=True))
-                        
-                        # Contar registros relacionados
+                        # Contar registros relacionados (subconsulta, sin traer los IDs)
                         detalles_produccion = DetalleProduccionInsumo.objects.filter(
-                            id_plato_producido__in=platos_ids
+                            id_plato_producido__in=platos
                         ).count()
                         
                         movimientos_mesa = MovimientoMesa.objects.filter(
-                            id_plato_producido__in=platos_ids
+                            id_plato_producido__in=platos
                         ).count()
                         
                         mermas = Merma.objects.filter(
-                            id_plato_producido__in=platos_ids
+                            id_plato_producido__in=platos
                         ).count()
                         
                         detalles_comanda = DetalleComanda.objects.filter(
-                            id_plato_producido__in=platos_ids
+                            id_plato_producido__in=platos
                         ).count()
                         
-                        # Obtener fechas de producción para eliminar ventas
-                        fechas_produccion = platos.values_list('fecha_produccion__date', 'id_plato').distinct()
-                        platos_ids_for_ventas = platos.values_list('id_plato', flat=True).distinct()
+                        # Pares (fecha, plato) de producción para eliminar ventas; se
+                        # materializan una vez y se reutilizan al contar y al eliminar
+                        fechas_produccion = list(
+                            platos.values_list('fecha_produccion__date', 'id_plato').distinct()
+                        )
                         
-                        # Contar ventas relacionadas
-                        ventas_count = 0
-                        for fecha_prod, plato_id in fechas_produccion:
-                            ventas = RegistroVentaPlato.objects.filter(
-                                id_plato=plato_id,
-                                fecha_venta=fecha_prod
-                            )
-                            ventas_count += ventas.count()
+                        # Contar ventas relacionadas (un COUNT por lote de pares)
+                        ventas_count = sum(
+                            RegistroVentaPlato.objects.filter(filtro_ventas(pares)).count()
+                            for pares in en_lotes(fechas_produccion, PARES_POR_CONSULTA)
+                        )
                         
                         self.stdout.write(f'  Platos producidos: {count_platos}')
                         self.stdout.write(f'  Detalles de produccion: {detalles_produccion}')
@@ -111,32 +136,46 @@ class Command(BaseCommand):
                         self.stdout.write(f'  Detalles de comanda: {detalles_comanda}')
                         
                         if not dry_run:
-                            # Eliminar en orden inverso de dependencias
-                            # 1. Movimientos de mesa (RESTRICT)
-                            MovimientoMesa.objects.filter(
-                                id_plato_producido__in=platos_ids
-                            ).delete()
-                            
-                            # 2. Mermas
-                            Merma.objects.filter(
-                                id_plato_producido__in=platos_ids
-                            ).delete()
-                            
-                            # 3. Desvincular detalles de comanda
-                            DetalleComanda.objects.filter(
-                                id_plato_producido__in=platos_ids
-                            ).update(id_plato_producido=None)
+                            # 1. Eliminar ventas relacionadas (misma fecha que producción),
+                            # antes de que desaparezcan los platos que las identifican
+                            for pares in en_lotes(fechas_produccion, PARES_POR_CONSULTA):
+                                RegistroVentaPlato.objects.filter(filtro_ventas(pares)).delete()
                             
-                            # 4. Eliminar ventas relacionadas (misma fecha que producción)
-                            for fecha_prod, plato_id in fechas_produccion:
-                                RegistroVentaPlato.objects.filter(
-                                    id_plato=plato_id,
-                                    fecha_venta=fecha_prod
+                            # Procesar los platos por lotes de IDs: en cada vuelta se toma
+                            # el primer lote de los que aún quedan
+                            while True:
+                                platos_ids = list(
+                                    platos.order_by().values_list('id_plato_producido', flat=True)[:IDS_POR_LOTE]
+                                )
+                                if not platos_ids:
+                                    break
+                                
+                                # Eliminar en orden inverso de dependencias
+                                # 2. Movimientos de mesa (RESTRICT)
+                                MovimientoMesa.objects.filter(
+                                    id_plato_producido__in=platos_ids
                                 ).delete()
-                            
-                            # 5. Los detalles de producción se eliminan por CASCADE
-                            # 6. Eliminar platos producidos
-                            platos.delete()
+                                
+                                # 3. Mermas
+                                Merma.objects.filter(
+                                    id_plato_producido__in=platos_ids
+                                ).delete()
+                                
+                                # 4. Desvincular detalles de comanda (un UPDATE por tramo de IDs)
+                                for ids_tramo in en_lotes(platos_ids, IDS_POR_ACTUALIZACION):
+                                    DetalleComanda.objects.filter(
+                                        id_plato_producido__in=ids_tramo
+                                    ).update(id_plato_producido=None)
+                                
+                                # 5. Detalles de producción (su CASCADE lo emula Django, no la BD)
+                                DetalleProduccionInsumo.objects.filter(
+                                    id_plato_producido__in=platos_ids
+                                ).delete()
+                                
+                                # 6. Eliminar platos producidos con un DELETE directo: ya no
+                                # quedan dependientes y no hay señales de borrado registradas
+                                platos_lote = PlatoProducido.objects.filter(id_plato_producido__in=platos_ids)
+                                platos_lote._raw_delete(platos_lote.db)
                             
                             total_eliminado['platos_producidos'] += count_platos
                             total_eliminado['detalles_produccion'] += detalles_produccion
@@ -182,13 +221,13 @@ class Command(BaseCommand):
                                 
                                 # Eliminar órdenes de compra si no tienen otros detalles
                                 ordenes_ids = list(detalles_compra.values_list('id_orden_compra', flat=True).distinct())
-                                for orden_id in ordenes_ids:
-                                    otros_detalles = DetalleCompra.objects.filter(
-                                        id_orden_compra=orden_id
-                                    ).exclude(id_detalle_compra__in=detalles_compra_ids).count()
-                                    
-                                    if otros_detalles == 0:
-                                        OrdenCompra.objects.filter(id_orden_compra=orden_id).delete()
+                                otros_detalles = DetalleCompra.objects.exclude(
+                                    id_detalle_compra__in=detalles_compra_ids
+                                )
+                                _, eliminados = OrdenCompra.objects.filter(
+                                    id_orden_compra__in=ordenes_ids
+                                ).exclude(detallecompra__in=otros_detalles).delete()
+                                total_eliminado['ordenes_compra'] += eliminados.get('inventario.OrdenCompra', 0)
                                 
                                 detalles_compra.delete()
                                 lotes.delete()
@@ -3,15 +3,112 @@ Comando para reducir datos de 2025 en un 80% para equilibrar con 2024
 Elimina producción, ventas y registros relacionados manteniendo integridad referencial
 """
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.db import connection, transaction
+from django.db.models import signals
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Value, Window
+from django.db.models.functions import ExtractMonth, Floor, Greatest, Random, RowNumber
 from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from itertools import islice
 from inventario.models import (
-    PlatoProducido, DetalleProduccionInsumo, RegistroVentaPlato,
-    MovimientoStock, Merma
+    PlatoProducido, DetalleProduccionInsumo, RegistroVentaPlato, Merma
 )
 from ventas.models import DetalleComanda, Comanda, MovimientoMesa
-import random
+import numpy as np
+import sys
+import traceback
+
+
+# Salida en UTF-8 con reemplazo: en consolas que no soportan algún carácter
+# (p. ej. cp1252 en Windows) el mensaje se imprime igual en vez de fallar
+if hasattr(sys.stdout, 'reconfigure'):
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+
+# Pares (plato, fecha) combinados por consulta al filtrar ventas
+PARES_POR_CONSULTA = 500
+
+# Filas traídas por viaje al recorrer los platos producidos de 2025
+FILAS_POR_VIAJE = 5000
+
+# IDs por DELETE al eliminar filas por clave primaria
+IDS_POR_LOTE = 10000
+
+# Platos producidos (y sus dependientes) eliminados por transacción
+PLATOS_POR_LOTE = 5000
+
+
+def en_lotes(iterable, tamaño):
+    """Recorre `iterable` en listas de hasta `tamaño` elementos"""
+    it = iter(iterable)
+    while True:
+        lote = list(islice(it, tamaño))
+        if not lote:
+            return
+        yield lote
+
+
+def eliminar_directo(queryset):
+    """
+    Elimina con un DELETE directo, sin pasar por el Collector de Django,
+    cuando el modelo no tiene señales de borrado. Devuelve las filas eliminadas
+    """
+    modelo = queryset.model
+    if signals.pre_delete.has_listeners(modelo) or signals.post_delete.has_listeners(modelo):
+        return queryset.delete()[0]
+    return queryset._raw_delete(queryset.db)
+
+
+def eliminar_lote_platos(ids_lote):
+    """
+    Elimina un lote de platos producidos y sus dependientes en una transacción.
+    Devuelve (detalles de comanda desvinculados, mermas, movimientos de mesa,
+    detalles de producción)
+    """
+    with transaction.atomic():
+        # Eliminar detalles de comanda relacionados
+        detalles_comanda = DetalleComanda.objects.filter(
+            id_plato_producido__in=ids_lote
+        ).update(id_plato_producido=None)  # No eliminar, solo desvincular
+        
+        # Eliminar mermas relacionadas
+        mermas = eliminar_directo(Merma.objects.filter(
+            id_plato_producido__in=ids_lote
+        ))
+        
+        # Eliminar movimientos de mesa relacionados (RESTRICT)
+        movimientos_mesa = eliminar_directo(MovimientoMesa.objects.filter(
+            id_plato_producido__in=ids_lote
+        ))
+        
+        # Detalles de producción (su CASCADE lo emula Django, no la BD)
+        detalles_produccion = eliminar_directo(DetalleProduccionInsumo.objects.filter(
+            id_plato_producido__in=ids_lote
+        ))
+        
+        # Eliminar los platos producidos, ya sin dependientes
+        eliminar_directo(PlatoProducido.objects.filter(
+            id_plato_producido__in=ids_lote
+        ))
+    
+    return detalles_comanda, mermas, movimientos_mesa, detalles_produccion
+
+
+def eliminar_lote_platos_en_hilo(ids_lote):
+    """eliminar_lote_platos() desde un hilo de trabajo, cerrando su conexión al terminar"""
+    try:
+        return eliminar_lote_platos(ids_lote)
+    finally:
+        connection.close()
+
+
+def filtro_ventas(pares):
+    """Q que selecciona las ventas de cada par (fecha_venta, id_plato)"""
+    q = Q()
+    for fecha, plato_id in pares:
+        q |= Q(id_plato=plato_id, fecha_venta=fecha)
+    return q
 
 
 class Command(BaseCommand):
@@ -29,15 +126,26 @@ class Command(BaseCommand):
             action='store_true',
             help='Solo mostrar qué se eliminaría sin hacer cambios'
         )
+        parser.add_argument(
+            '--parallel',
+            type=int,
+            default=1,
+            help='Lotes de platos eliminados en paralelo, cada uno con su propia conexión (default: 1)'
+        )
 
     def handle(self, *args, **options):
         porcentaje = options['porcentaje']
         dry_run = options['dry_run']
+        paralelo = options['parallel']
         
         if porcentaje < 0 or porcentaje > 100:
             self.stdout.write(self.style.ERROR('El porcentaje debe estar entre 0 y 100'))
             return
         
+        if paralelo < 1:
+            self.stdout.write(self.style.ERROR('--parallel debe ser al menos 1'))
+            return
+        
         # Calcular fracción a mantener (si eliminamos 80%, mantenemos 20%)
         fraccion_mantener = (100 - porcentaje) / 100.0
         
@@ -49,178 +157,150 @@ class Command(BaseCommand):
         self.stdout.write(f'Modo: {"DRY RUN (sin cambios)" if dry_run else "EJECUCION REAL"}')
         self.stdout.write(f'{"="*60}\n')
         
+        # Sin una transacción global: cada DELETE y cada lote de platos confirma
+        # por separado, así una ejecución larga no retiene una transacción enorme
         try:
-            with transaction.atomic():
-                # 1. Obtener todos los platos producidos de 2025
-                platos_2025 = PlatoProducido.objects.filter(
-                    fecha_produccion__year=2025
-                ).order_by('fecha_produccion')
+            # 1. Obtener todos los platos producidos de 2025
+            platos_2025 = PlatoProducido.objects.filter(
+                fecha_produccion__year=2025
+            ).order_by('fecha_produccion')
+            
+            total_platos = platos_2025.count()
+            platos_a_mantener = int(total_platos * fraccion_mantener)
+            platos_a_eliminar = total_platos - platos_a_mantener
+            
+            self.stdout.write(f'Platos producidos en 2025: {total_platos}')
+            self.stdout.write(f'Platos a mantener: {platos_a_mantener}')
+            self.stdout.write(f'Platos a eliminar: {platos_a_eliminar}')
+            
+            if platos_a_eliminar > 0:
+                # Seleccionar aleatoriamente qué platos mantener (distribuidos en el tiempo)
+                # Esto asegura que no eliminemos todos los datos de un mes específico
+                # Estrategia: mantener una distribución uniforme en el tiempo
+                # Dividir en grupos por mes y mantener una fracción de cada mes.
+                # El sorteo lo hace la base de datos: numera los platos de cada mes
+                # en orden aleatorio y solo devuelve los que quedan fuera de la
+                # fracción a mantener, como tuplas (id, mes, plato, fecha)
+                mes = ExtractMonth('fecha_produccion')
+                filas_a_eliminar = platos_2025.order_by().annotate(
+                    mes=mes,
+                    orden=Window(RowNumber(), partition_by=mes, order_by=Random().asc()),
+                    total_mes=Window(Count('pk'), partition_by=mes),
+                ).filter(
+                    orden__gt=Greatest(
+                        Value(1.0),
+                        Floor(ExpressionWrapper(F('total_mes') * fraccion_mantener, output_field=FloatField()))
+                    )
+                ).values_list(
+                    'id_plato_producido', 'mes', 'id_plato', 'fecha_produccion__date'
+                ).iterator(chunk_size=FILAS_POR_VIAJE)
+                
+                platos_a_eliminar_ids = []
+                eliminar_por_mes = {}
+                pares_ventas = set()
                 
-                total_platos = platos_2025.count()
-                platos_a_mantener = int(total_platos * fraccion_mantener)
-                platos_a_eliminar = total_platos - platos_a_mantener
+                for plato_producido_id, mes_plato, plato_id, fecha in filas_a_eliminar:
+                    platos_a_eliminar_ids.append(plato_producido_id)
+                    eliminar_por_mes[mes_plato] = eliminar_por_mes.get(mes_plato, 0) + 1
+                    # Pares (fecha, plato) de producción que identifican las ventas
+                    pares_ventas.add((fecha, plato_id))
                 
-                self.stdout.write(f'Platos producidos en 2025: {total_platos}')
-                self.stdout.write(f'Platos a mantener: {platos_a_mantener}')
-                self.stdout.write(f'Platos a eliminar: {platos_a_eliminar}')
+                total_por_mes = dict(
+                    platos_2025.order_by().annotate(mes=mes).values_list('mes').annotate(total=Count('pk'))
+                )
+                
+                self.stdout.write(f'\nDistribucion por mes:')
+                for mes_plato in sorted(total_por_mes.keys()):
+                    total_mes = total_por_mes[mes_plato]
+                    eliminar_mes = eliminar_por_mes.get(mes_plato, 0)
+                    self.stdout.write(f'  Mes {mes_plato}: {total_mes} total, {total_mes - eliminar_mes} a mantener, {eliminar_mes} a eliminar')
                 
-                if platos_a_eliminar > 0:
-                    # Seleccionar aleatoriamente qué platos mantener (distribuidos en el tiempo)
-                    # Esto asegura que no eliminemos todos los datos de un mes específico
-                    platos_lista = list(platos_2025)
+                if not dry_run:
+                    # Eliminar en orden inverso de dependencias
+                    # 1. Detalles de producción (se eliminan automáticamente con CASCADE)
+                    # 2. Movimientos de stock relacionados
+                    # 3. Mermas relacionadas
+                    # 4. Detalles de comanda relacionados
+                    # 5. Registros de venta relacionados
+                    # 6. Finalmente los platos producidos
                     
-                    # Estrategia: mantener una distribución uniforme en el tiempo
-                    # Dividir en grupos por mes y mantener una fracción de cada mes
-                    platos_por_mes = {}
-                    for plato in platos_lista:
-                        mes = plato.fecha_produccion.month
-                        if mes not in platos_por_mes:
-                            platos_por_mes[mes] = []
-                        platos_por_mes[mes].append(plato)
+                    # Los conteos se toman de lo que devuelven delete() y update(),
+                    # sin consultas COUNT previas
+                    # Eliminar registros de venta relacionados (un DELETE por lote de pares)
+                    ventas_eliminadas = 0
+                    for pares in en_lotes(pares_ventas, PARES_POR_CONSULTA):
+                        _, eliminados = RegistroVentaPlato.objects.filter(filtro_ventas(pares)).delete()
+                        ventas_eliminadas += eliminados.get(RegistroVentaPlato._meta.label, 0)
                     
-                    platos_a_eliminar_ids = []
-                    platos_a_mantener_ids = []
+                    # Platos y dependientes por lotes de IDs, cada lote en su propia
+                    # transacción corta para acotar el tamaño del IN y del undo log.
+                    # Los lotes no comparten filas, así que con --parallel se reparten
+                    # entre hilos, cada uno con su propia conexión
+                    lotes_platos = en_lotes(platos_a_eliminar_ids, PLATOS_POR_LOTE)
+                    if paralelo > 1:
+                        with ThreadPoolExecutor(max_workers=paralelo) as executor:
+                            resultados = list(executor.map(eliminar_lote_platos_en_hilo, lotes_platos))
+                    else:
+                        resultados = [eliminar_lote_platos(ids_lote) for ids_lote in lotes_platos]
                     
-                    for mes, platos_mes in platos_por_mes.items():
-                        total_mes = len(platos_mes)
-                        mantener_mes = max(1, int(total_mes * fraccion_mantener))
-                        
-                        # Seleccionar aleatoriamente qué mantener
-                        random.shuffle(platos_mes)
-                        mantener = platos_mes[:mantener_mes]
-                        eliminar = platos_mes[mantener_mes:]
-                        
-                        platos_a_mantener_ids.extend([p.id_plato_producido for p in mantener])
-                        platos_a_eliminar_ids.extend([p.id_plato_producido for p in eliminar])
+                    (detalles_comanda_eliminados, mermas_eliminadas,
+                     movimientos_mesa_eliminados, detalles_produccion) = (
+                        sum(conteos) for conteos in zip((0, 0, 0, 0), *resultados)
+                    )
                     
-                    self.stdout.write(f'\nDistribucion por mes:')
-                    for mes in sorted(platos_por_mes.keys()):
-                        total_mes = len(platos_por_mes[mes])
-                        mantener_mes = len([p for p in platos_por_mes[mes] if p.id_plato_producido in platos_a_mantener_ids])
-                        self.stdout.write(f'  Mes {mes}: {total_mes} total, {mantener_mes} a mantener, {total_mes - mantener_mes} a eliminar')
+                    self.stdout.write(self.style.SUCCESS(f'\n[OK] Eliminados exitosamente:'))
+                    self.stdout.write(f'  - {platos_a_eliminar} platos producidos')
+                    self.stdout.write(f'  - {detalles_produccion} detalles de produccion')
+                    self.stdout.write(f'  - {ventas_eliminadas} registros de venta')
+                    self.stdout.write(f'  - {detalles_comanda_eliminados} detalles de comanda desvinculados')
+                    self.stdout.write(f'  - {mermas_eliminadas} mermas')
+                    self.stdout.write(f'  - {movimientos_mesa_eliminados} movimientos de mesa')
+                else:
+                    # Contar para dry-run
+                    detalles_produccion_count = sum(
+                        DetalleProduccionInsumo.objects.filter(id_plato_producido__in=ids_lote).count()
+                        for ids_lote in en_lotes(platos_a_eliminar_ids, PLATOS_POR_LOTE)
+                    )
                     
-                    if not dry_run:
-                        # Eliminar en orden inverso de dependencias
-                        # 1. Detalles de producción (se eliminan automáticamente con CASCADE)
-                        # 2. Movimientos de stock relacionados
-                        # 3. Mermas relacionadas
-                        # 4. Detalles de comanda relacionados
-                        # 5. Registros de venta relacionados
-                        # 6. Finalmente los platos producidos
-                        
-                        platos_a_eliminar_objs = PlatoProducido.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        )
-                        
-                        # Contar registros relacionados antes de eliminar
-                        detalles_produccion = DetalleProduccionInsumo.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).count()
-                        
-                        movimientos_stock = MovimientoStock.objects.filter(
-                            id_lote__in=platos_a_eliminar_objs.values_list('id_plato_producido', flat=True)
-                        ).count()
-                        
-                        # Obtener IDs de platos para eliminar registros de venta
-                        platos_ids = platos_a_eliminar_objs.values_list('id_plato', flat=True)
-                        fechas_produccion = platos_a_eliminar_objs.values_list('fecha_produccion__date', flat=True)
-                        
-                        # Eliminar registros de venta relacionados
-                        ventas_eliminadas = 0
-                        for plato_obj in platos_a_eliminar_objs:
-                            fecha_venta = plato_obj.fecha_produccion.date()
-                            ventas = RegistroVentaPlato.objects.filter(
-                                id_plato=plato_obj.id_plato,
-                                fecha_venta=fecha_venta
-                            )
-                            ventas_eliminadas += ventas.count()
-                            ventas.delete()
-                        
-                        # Eliminar detalles de comanda relacionados
-                        detalles_comanda_eliminados = DetalleComanda.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).count()
-                        DetalleComanda.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).update(id_plato_producido=None)  # No eliminar, solo desvincular
-                        
-                        # Eliminar mermas relacionadas
-                        mermas_eliminadas = Merma.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).count()
-                        Merma.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).delete()
-                        
-                        # Eliminar movimientos de mesa relacionados (RESTRICT)
-                        movimientos_mesa_eliminados = MovimientoMesa.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).count()
-                        MovimientoMesa.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).delete()
-                        
-                        # Los detalles de producción se eliminan automáticamente por CASCADE
-                        # Eliminar los platos producidos
-                        platos_a_eliminar_objs.delete()
-                        
-                        self.stdout.write(self.style.SUCCESS(f'\n[OK] Eliminados exitosamente:'))
-                        self.stdout.write(f'  - {platos_a_eliminar} platos producidos')
-                        self.stdout.write(f'  - {detalles_produccion} detalles de produccion')
-                        self.stdout.write(f'  - {ventas_eliminadas} registros de venta')
-                        self.stdout.write(f'  - {detalles_comanda_eliminados} detalles de comanda desvinculados')
-                        self.stdout.write(f'  - {mermas_eliminadas} mermas')
-                        self.stdout.write(f'  - {movimientos_mesa_eliminados} movimientos de mesa')
-                    else:
-                        # Contar para dry-run
-                        detalles_produccion_count = DetalleProduccionInsumo.objects.filter(
-                            id_plato_producido__in=platos_a_eliminar_ids
-                        ).count()
-                        
-                        self.stdout.write(self.style.WARNING(f'\n[DRY RUN] Se eliminarian:'))
-                        self.stdout.write(f'  - {platos_a_eliminar} platos producidos')
-                        self.stdout.write(f'  - Aproximadamente {detalles_produccion_count} detalles de produccion')
-                
-                # 2. Eliminar registros de venta adicionales que no estén vinculados a platos producidos
-                ventas_2025 = RegistroVentaPlato.objects.filter(
-                    fecha_venta__year=2025
+                    self.stdout.write(self.style.WARNING(f'\n[DRY RUN] Se eliminarian:'))
+                    self.stdout.write(f'  - {platos_a_eliminar} platos producidos')
+                    self.stdout.write(f'  - Aproximadamente {detalles_produccion_count} detalles de produccion')
+            
+            # 2. Eliminar registros de venta adicionales que no estén vinculados a platos producidos
+            ventas_2025 = RegistroVentaPlato.objects.filter(
+                fecha_venta__year=2025
+            )
+            total_ventas = ventas_2025.count()
+            ventas_a_mantener = int(total_ventas * fraccion_mantener)
+            ventas_a_eliminar = total_ventas - ventas_a_mantener
+            
+            if ventas_a_eliminar > 0:
+                # Solo se traen los IDs a un arreglo de NumPy y se barajan ahí
+                ids_ventas = np.fromiter(
+                    ventas_2025.order_by().values_list('pk', flat=True).iterator(chunk_size=FILAS_POR_VIAJE),
+                    dtype=np.int64
                 )
-                total_ventas = ventas_2025.count()
-                ventas_a_mantener = int(total_ventas * fraccion_mantener)
-                ventas_a_eliminar = total_ventas - ventas_a_mantener
-                
-                if ventas_a_eliminar > 0:
-                    ventas_lista = list(ventas_2025)
-                    random.shuffle(ventas_lista)
-                    ventas_a_eliminar_objs = ventas_lista[ventas_a_mantener:]
-                    
-                    if not dry_run:
-                        for venta in ventas_a_eliminar_objs:
-                            venta.delete()
-                        self.stdout.write(f'\n[OK] Eliminados {ventas_a_eliminar} registros de venta adicionales')
-                    else:
-                        self.stdout.write(f'\n[DRY RUN] Se eliminarian {ventas_a_eliminar} registros de venta adicionales')
+                ids_a_eliminar = np.random.default_rng().permutation(ids_ventas)[ventas_a_mantener:]
                 
-                if dry_run:
-                    self.stdout.write(self.style.WARNING('\n[DRY RUN] MODO DRY RUN: No se realizaron cambios'))
-                    self.stdout.write('Ejecuta sin --dry-run para aplicar los cambios')
+                if not dry_run:
+                    for ids_lote in en_lotes(ids_a_eliminar.tolist(), IDS_POR_LOTE):
+                        RegistroVentaPlato.objects.filter(pk__in=ids_lote).delete()
+                    self.stdout.write(f'\n[OK] Eliminados {ventas_a_eliminar} registros de venta adicionales')
                 else:
-                    # Confirmar transacción
-                    self.stdout.write(self.style.SUCCESS('\n' + '='*60))
-                    self.stdout.write(self.style.SUCCESS('[OK] Reduccion completada exitosamente!'))
-                    self.stdout.write(self.style.SUCCESS('='*60))
-                    self.stdout.write(self.style.SUCCESS('\nLos datos de 2025 ahora estan mas equilibrados con 2024.'))
-                    self.stdout.write(self.style.SUCCESS('Las predicciones deberian mostrar diferencias mas razonables.'))
+                    self.stdout.write(f'\n[DRY RUN] Se eliminarian {ventas_a_eliminar} registros de venta adicionales')
+            
+            if dry_run:
+                self.stdout.write(self.style.WARNING('\n[DRY RUN] MODO DRY RUN: No se realizaron cambios'))
+                self.stdout.write('Ejecuta sin --dry-run para aplicar los cambios')
+            else:
+                self.stdout.write(self.style.SUCCESS('\n' + '='*60))
+                self.stdout.write(self.style.SUCCESS('[OK] Reduccion completada exitosamente!'))
+                self.stdout.write(self.style.SUCCESS('='*60))
+                self.stdout.write(self.style.SUCCESS('\nLos datos de 2025 ahora estan mas equilibrados con 2024.'))
+                self.stdout.write(self.style.SUCCESS('Las predicciones deberian mostrar diferencias mas razonables.'))
         
         except Exception as e:
-            error_msg = str(e).encode('ascii', 'ignore').decode('ascii')
-            self.stdout.write(self.style.ERROR(f'\n[ERROR] Error al reducir datos: {error_msg}'))
-            import traceback
-            try:
-                traceback_str = traceback.format_exc()
-                traceback_clean = traceback_str.encode('ascii', 'ignore').decode('ascii')
-                self.stdout.write(traceback_clean)
-            except:
-                pass
+            self.stdout.write(self.style.ERROR(f'\n[ERROR] Error al reducir datos: {e}'))
+            self.stdout.write(traceback.format_exc())
             raise
 
@@ -4,10 +4,11 @@ Comando para verificar qué datos tiene el sistema para Machine Learning
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import datetime, timedelta, date
-from django.db.models import Sum, Count
+from django.db.models import Sum, Count, Exists, OuterRef, Q
+from django.db.models.functions import TruncDate
 from inventario.models import (
     Insumo, Plato, DetalleProduccionInsumo, 
-    Lote, Receta, DetalleReceta, PlatoProducido
+    Lote, Receta, PlatoProducido
 )
 
 
@@ -15,29 +16,36 @@ class Command(BaseCommand):
     help = 'Verifica qué datos tiene el sistema para Machine Learning'
 
     def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS('\n=== VERIFICACIÓN DE DATOS PARA ML ===\n'))
+        # El informe se arma en una lista y se escribe de una vez al final;
+        # self.style devuelve cadenas, así que las líneas con estilo van igual
+        lineas = []
+        lineas.append(self.style.SUCCESS('\n=== VERIFICACIÓN DE DATOS PARA ML ===\n'))
         
         # 1. Verificar insumos
         total_insumos = Insumo.objects.count()
-        self.stdout.write(f'✓ Insumos en el sistema: {total_insumos}')
+        lineas.append(f'✓ Insumos en el sistema: {total_insumos}')
         
         # 2. Verificar platos
         total_platos = Plato.objects.count()
-        self.stdout.write(f'✓ Platos en el sistema: {total_platos}')
+        lineas.append(f'✓ Platos en el sistema: {total_platos}')
         
         # 3. Verificar recetas
         total_recetas = Receta.objects.count()
-        platos_sin_receta = Plato.objects.exclude(
-            id_plato__in=Receta.objects.values_list('id_plato_id', flat=True)
+        platos_sin_receta = Plato.objects.filter(
+            ~Exists(Receta.objects.filter(id_plato=OuterRef('pk')))
         ).count()
-        self.stdout.write(f'✓ Recetas en el sistema: {total_recetas}')
+        lineas.append(f'✓ Recetas en el sistema: {total_recetas}')
         if platos_sin_receta > 0:
-            self.stdout.write(self.style.WARNING(f'  ⚠️  {platos_sin_receta} platos SIN receta'))
+            lineas.append(self.style.WARNING(f'  ⚠️  {platos_sin_receta} platos SIN receta'))
         
         # 4. Verificar lotes con stock
-        lotes_con_stock = Lote.objects.filter(cantidad_actual__gt=0).count()
-        total_lotes = Lote.objects.count()
-        self.stdout.write(f'✓ Lotes con stock: {lotes_con_stock} de {total_lotes} totales')
+        conteo_lotes = Lote.objects.aggregate(
+            total=Count('pk'),
+            con_stock=Count('pk', filter=Q(cantidad_actual__gt=0))
+        )
+        lotes_con_stock = conteo_lotes['con_stock']
+        total_lotes = conteo_lotes['total']
+        lineas.append(f'✓ Lotes con stock: {lotes_con_stock} de {total_lotes} totales')
         
         # 5. Verificar consumo histórico (LO MÁS IMPORTANTE)
         hoy = date.today()
@@ -45,44 +53,42 @@ class Command(BaseCommand):
         fecha_inicio_30 = hoy - timedelta(days=30)
         fecha_inicio_7 = hoy - timedelta(days=7)
         
-        fecha_inicio_180_dt = datetime.combine(fecha_inicio_180, datetime.min.time())
-        fecha_inicio_180_dt = timezone.make_aware(fecha_inicio_180_dt)
-        
-        fecha_inicio_30_dt = datetime.combine(fecha_inicio_30, datetime.min.time())
-        fecha_inicio_30_dt = timezone.make_aware(fecha_inicio_30_dt)
-        
-        fecha_inicio_7_dt = datetime.combine(fecha_inicio_7, datetime.min.time())
-        fecha_inicio_7_dt = timezone.make_aware(fecha_inicio_7_dt)
-        
-        consumos_180 = DetalleProduccionInsumo.objects.filter(
-            fecha_uso__gte=fecha_inicio_180_dt
-        ).count()
-        
-        consumos_30 = DetalleProduccionInsumo.objects.filter(
-            fecha_uso__gte=fecha_inicio_30_dt
-        ).count()
-        
-        consumos_7 = DetalleProduccionInsumo.objects.filter(
-            fecha_uso__gte=fecha_inicio_7_dt
-        ).count()
-        
-        total_consumos = DetalleProduccionInsumo.objects.count()
-        
-        self.stdout.write(f'\n📊 REGISTROS DE CONSUMO (DetalleProduccionInsumo):')
-        self.stdout.write(f'  • Total en el sistema: {total_consumos}')
-        self.stdout.write(f'  • Últimos 180 días: {consumos_180}')
-        self.stdout.write(f'  • Últimos 30 días: {consumos_30}')
-        self.stdout.write(f'  • Últimos 7 días: {consumos_7}')
+        # Inicio de cada ventana a medianoche, con la zona horaria resuelta una vez
+        tz = timezone.get_current_timezone()
+        fecha_inicio_180_dt = datetime(fecha_inicio_180.year, fecha_inicio_180.month, fecha_inicio_180.day, tzinfo=tz)
+        fecha_inicio_30_dt = datetime(fecha_inicio_30.year, fecha_inicio_30.month, fecha_inicio_30.day, tzinfo=tz)
+        fecha_inicio_7_dt = datetime(fecha_inicio_7.year, fecha_inicio_7.month, fecha_inicio_7.day, tzinfo=tz)
+        
+        # Los conteos, incluidos los días únicos, en una sola consulta con
+        # agregados condicionales
+        conteo_consumos = DetalleProduccionInsumo.objects.aggregate(
+            total=Count('pk'),
+            ultimos_180=Count('pk', filter=Q(fecha_uso__gte=fecha_inicio_180_dt)),
+            ultimos_30=Count('pk', filter=Q(fecha_uso__gte=fecha_inicio_30_dt)),
+            ultimos_7=Count('pk', filter=Q(fecha_uso__gte=fecha_inicio_7_dt)),
+            dias_180=Count(
+                TruncDate('fecha_uso'), distinct=True,
+                filter=Q(fecha_uso__gte=fecha_inicio_180_dt)
+            )
+        )
+        consumos_180 = conteo_consumos['ultimos_180']
+        consumos_30 = conteo_consumos['ultimos_30']
+        consumos_7 = conteo_consumos['ultimos_7']
+        total_consumos = conteo_consumos['total']
+        
+        lineas.append(f'\n📊 REGISTROS DE CONSUMO (DetalleProduccionInsumo):')
+        lineas.append(f'  • Total en el sistema: {total_consumos}')
+        lineas.append(f'  • Últimos 180 días: {consumos_180}')
+        lineas.append(f'  • Últimos 30 días: {consumos_30}')
+        lineas.append(f'  • Últimos 7 días: {consumos_7}')
         
         # Verificar días únicos con datos
-        fechas_unicas = DetalleProduccionInsumo.objects.filter(
-            fecha_uso__gte=fecha_inicio_180_dt
-        ).values_list('fecha_uso__date', flat=True).distinct().count()
+        fechas_unicas = conteo_consumos['dias_180']
         
-        self.stdout.write(f'  • Días únicos con datos (últimos 180 días): {fechas_unicas}')
+        lineas.append(f'  • Días únicos con datos (últimos 180 días): {fechas_unicas}')
         
         # 6. Verificar consumo por insumo
-        self.stdout.write(f'\n📦 CONSUMO POR INSUMO (últimos 180 días):')
+        lineas.append(f'\n📦 CONSUMO POR INSUMO (últimos 180 días):')
         insumos_con_consumo = DetalleProduccionInsumo.objects.filter(
             fecha_uso__gte=fecha_inicio_180_dt
         ).values('id_insumo__nombre_insumo', 'id_insumo__id_insumo').annotate(
@@ -92,26 +98,28 @@ class Command(BaseCommand):
         
         if insumos_con_consumo:
             for item in insumos_con_consumo:
-                self.stdout.write(
+                lineas.append(
                     f'  • {item["id_insumo__nombre_insumo"]}: '
                     f'{item["num_registros"]} registros, '
                     f'{item["total_consumo"]:.2f} unidades consumidas'
                 )
         else:
-            self.stdout.write(self.style.ERROR('  ❌ NO HAY DATOS DE CONSUMO'))
+            lineas.append(self.style.ERROR('  ❌ NO HAY DATOS DE CONSUMO'))
         
         # 7. Verificar platos producidos
-        platos_producidos_total = PlatoProducido.objects.count()
-        platos_producidos_180 = PlatoProducido.objects.filter(
-            fecha_produccion__gte=fecha_inicio_180_dt
-        ).count()
+        conteo_platos_producidos = PlatoProducido.objects.aggregate(
+            total=Count('pk'),
+            ultimos_180=Count('pk', filter=Q(fecha_produccion__gte=fecha_inicio_180_dt))
+        )
+        platos_producidos_total = conteo_platos_producidos['total']
+        platos_producidos_180 = conteo_platos_producidos['ultimos_180']
         
-        self.stdout.write(f'\n🍽️  PLATOS PRODUCIDOS:')
-        self.stdout.write(f'  • Total: {platos_producidos_total}')
-        self.stdout.write(f'  • Últimos 180 días: {platos_producidos_180}')
+        lineas.append(f'\n🍽️  PLATOS PRODUCIDOS:')
+        lineas.append(f'  • Total: {platos_producidos_total}')
+        lineas.append(f'  • Últimos 180 días: {platos_producidos_180}')
         
         # 8. Diagnóstico
-        self.stdout.write(f'\n🔍 DIAGNÓSTICO:')
+        lineas.append(f'\n🔍 DIAGNÓSTICO:')
         
         problemas = []
         if total_insumos == 0:
@@ -128,13 +136,13 @@ class Command(BaseCommand):
             problemas.append(f'Solo hay {fechas_unicas} días únicos con datos (mínimo 20 días)')
         
         if problemas:
-            self.stdout.write(self.style.ERROR('\n❌ PROBLEMAS ENCONTRADOS:'))
+            lineas.append(self.style.ERROR('\n❌ PROBLEMAS ENCONTRADOS:'))
             for problema in problemas:
-                self.stdout.write(self.style.ERROR(f'  • {problema}'))
+                lineas.append(self.style.ERROR(f'  • {problema}'))
             
-            self.stdout.write(self.style.WARNING('\n💡 SOLUCIÓN:'))
+            lineas.append(self.style.WARNING('\n💡 SOLUCIÓN:'))
             if consumos_180 < 20 or fechas_unicas < 20:
-                self.stdout.write(
+                lineas.append(
                     '  El sistema necesita datos de CONSUMO de insumos, no solo compras.\n'
                     '  Los datos de consumo se generan cuando:\n'
                     '  1. Produces platos en el sistema\n'
@@ -143,7 +151,11 @@ class Command(BaseCommand):
                     '  python manage.py generar_datos_consumo --dias 90'
                 )
         else:
-            self.stdout.write(self.style.SUCCESS('\n✅ El sistema tiene suficientes datos para ML'))
-        
-        self.stdout.write('\n')
-
+            lineas.append(self.style.SUCCESS('\n✅ El sistema tiene suficientes datos para ML'))
+        
+        lineas.append('\n')
+        # Igual que stdout.write: salto de línea solo si la línea no lo trae
+        self.stdout.write(
+            ''.join(linea if linea.endswith('\n') else linea + '\n' for linea in lineas),
+            ending=''
+        )
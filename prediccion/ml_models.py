@@ -2,20 +2,45 @@
 Módulo de Machine Learning para predicciones en CocinAI
 Implementa modelos ML reales para predicción de ventas, demanda, mermas y recomendaciones
 """
+import os
+
+# Hilos por proceso: con varios workers web (WEB_CONCURRENCY) cada uno usa su parte de los núcleos
+# en vez de que todos los entrenamientos compitan por todos ellos
+_N_JOBS = max(1, (os.cpu_count() or 4) // max(1, int(os.environ.get('WEB_CONCURRENCY', '1'))))
+
+# OpenMP (sklearn, XGBoost, LightGBM) lee la variable al cargarse: fijarla antes de importarlos
+os.environ.setdefault('OMP_NUM_THREADS', str(_N_JOBS))
+
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta, date
+from datetime import datetime, timedelta, date, timezone as dt_timezone
 from typing import Dict, List, Tuple, Optional
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+
+# Intel Extension for Scikit-learn (opcional): acelera RandomForest, Ridge y LinearRegression
+# sin cambiar la API. Debe aplicarse antes de importar los estimadores de sklearn
+try:
+    from sklearnex import patch_sklearn
+    patch_sklearn(verbose=False)
+    SKLEARNEX_DISPONIBLE = True
+except ImportError:
+    SKLEARNEX_DISPONIBLE = False
+
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression, Ridge
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split, TimeSeriesSplit
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 from sklearn.cluster import KMeans
 from sklearn.ensemble import IsolationForest
 import warnings
 import pickle
-import os
+import gc
+import math
+import time
+import tempfile
+import joblib
+from collections import deque
+from functools import lru_cache
 from pathlib import Path
 warnings.filterwarnings('ignore')
 
@@ -23,8 +48,16 @@ warnings.filterwarnings('ignore')
 try:
     import xgboost as xgb
     XGBOOST_DISPONIBLE = True
+    # Entrenar en GPU solo si XGBoost trae soporte CUDA y el driver NVIDIA expone alguna GPU
+    # (los wheels de pip incluyen CUDA aunque el equipo no tenga GPU)
+    _RUTA_GPUS_NVIDIA = '/proc/driver/nvidia/gpus'
+    XGBOOST_GPU = (
+        bool(xgb.build_info().get('USE_CUDA'))
+        and os.path.isdir(_RUTA_GPUS_NVIDIA) and bool(os.listdir(_RUTA_GPUS_NVIDIA))
+    )
 except ImportError:
     XGBOOST_DISPONIBLE = False
+    XGBOOST_GPU = False
     xgb = None
 
 try:
@@ -34,12 +67,35 @@ except ImportError:
     LIGHTGBM_DISPONIBLE = False
     lgb = None
 
+# Numba (opcional) compila el cálculo de features de calendario
+try:
+    from numba import njit
+    NUMBA_DISPONIBLE = True
+except ImportError:
+    NUMBA_DISPONIBLE = False
+    njit = None
+
+# lleaves (opcional) compila los Booster de LightGBM a código nativo para predecir día a día
+try:
+    import lleaves
+    LLEAVES_DISPONIBLE = True
+except ImportError:
+    LLEAVES_DISPONIBLE = False
+    lleaves = None
+
+# lz4 comprime/descomprime más rápido que zlib; si no está, usar zlib nivel 3
+try:
+    import lz4  # noqa: F401
+    COMPRESION_MODELOS = ('lz4', 3)
+except ImportError:
+    COMPRESION_MODELOS = 3
+
 from inventario.models import (
     PlatoProducido, Merma, Lote, Insumo, Plato, 
     DetalleProduccionInsumo, CausaMerma, Usuario, RegistroVentaPlato, Receta
 )
 from ventas.models import DetalleComanda
-from django.db.models import Sum, Count, Avg, Q
+from django.db.models import Sum, Count, Avg, Max, Q
 from django.db.models.functions import TruncDay, TruncWeek, TruncMonth
 from .config_ml import obtener_dias_minimos
 
@@ -47,32 +103,98 @@ from .config_ml import obtener_dias_minimos
 # Usar BASE_DIR del proyecto Django
 try:
     from django.conf import settings
+    from django.core.exceptions import ImproperlyConfigured
     MODELS_DIR = Path(settings.BASE_DIR) / 'models_ml'
-except:
+except (ImportError, ImproperlyConfigured, AttributeError):
     # Fallback si no está en contexto Django
     MODELS_DIR = Path(__file__).resolve().parent.parent.parent / 'models_ml'
 
-# Crear directorio si no existe
-MODELS_DIR.mkdir(exist_ok=True)
+# El directorio se crea al guardar el primer modelo (no al importar el módulo)
+_directorio_modelos_creado = False
+
+# Los modelos se guardan con joblib; los .pkl antiguos se siguen pudiendo leer
+EXTENSION_MODELO = '.joblib'
+EXTENSION_LEGADA = '.pkl'
+
+# Caché en memoria de modelos cargados: (plato_id, modelo_tipo) -> (ruta, mtime, cargado_en, resultado)
+_MODEL_CACHE: Dict[tuple, tuple] = {}
+MODEL_CACHE_TTL = 300  # segundos
+
+# Modelos compilados con lleaves: (plato_id, modelo_tipo) -> (mtime del .joblib, modelos)
+_MODELOS_COMPILADOS: Dict[tuple, tuple] = {}
+
+# Caché de datos preparados: (plato_id, dias_historia, día) -> (firma de ventas, DataFrame)
+_DATA_CACHE: Dict[tuple, tuple] = {}
+
+# Filas por viaje a la BD al leer ventas con .iterator()
+FILAS_POR_LOTE_VENTAS = 5000
+# Sobre este número de ventas leídas se fuerza gc.collect() al liberar los intermedios
+FILAS_PARA_GC = 100_000
+
+
+# Tablas sin/cos precalculadas para las features cíclicas: las entradas son enteros acotados
+# (día de la semana, día del mes, mes, trimestre, día del año), así que basta indexarlas
+_DOW_SIN = np.sin(2 * np.pi * np.arange(7) / 7).astype(np.float32)
+_DOW_COS = np.cos(2 * np.pi * np.arange(7) / 7).astype(np.float32)
+_DOM_SIN = np.sin(2 * np.pi * np.arange(32) / 31).astype(np.float32)
+_DOM_COS = np.cos(2 * np.pi * np.arange(32) / 31).astype(np.float32)
+_MES_SIN = np.sin(2 * np.pi * np.arange(13) / 12).astype(np.float32)
+_MES_COS = np.cos(2 * np.pi * np.arange(13) / 12).astype(np.float32)
+_TRIM_SIN = np.sin(2 * np.pi * np.arange(5) / 4).astype(np.float32)
+_TRIM_COS = np.cos(2 * np.pi * np.arange(5) / 4).astype(np.float32)
+_DOY_SIN = np.sin(2 * np.pi * np.arange(367) / 365.25).astype(np.float32)
+_DOY_COS = np.cos(2 * np.pi * np.arange(367) / 365.25).astype(np.float32)
+
+
+# Features base del modelo de ventas, en el orden de entrenamiento (las genera preparar_datos_ventas)
+_FEATURES_BASE_VENTAS = (
+    # Features temporales básicas
+    'dia_semana', 'mes', 'año', 'dia_mes', 'semana_año', 'trimestre', 'dia_año',
+    # Features cíclicas (sin/cos)
+    'dia_semana_sin', 'dia_semana_cos', 'mes_sin', 'mes_cos',
+    'dia_mes_sin', 'dia_mes_cos', 'trimestre_sin', 'trimestre_cos',
+    'dia_año_sin', 'dia_año_cos',
+    # Features booleanas
+    'es_fin_semana', 'es_inicio_mes', 'es_mitad_mes', 'es_fin_mes',
+    'es_lunes', 'es_viernes',
+    # Features de calendario
+    'es_feriado', 'es_dia_pago', 'cerca_feriado',
+    'es_verano', 'es_invierno', 'es_temporada_alta',
+    'dias_desde_feriado', 'dias_hasta_feriado',
+    # Medias móviles (tendencias)
+    'media_movil_7', 'media_movil_14', 'media_movil_30',
+    # Lag features (ventas anteriores)
+    'lag_1', 'lag_7', 'lag_14',
+    # Volatilidad
+    'std_movil_7',
+)
+
+# Features que dependen de las ventas de días anteriores: al predecir se recalculan día a día
+_FEATURES_AUTORREGRESIVAS = (
+    'media_movil_7', 'media_movil_14', 'media_movil_30',
+    'lag_1', 'lag_7', 'lag_14', 'std_movil_7',
+    'ratio_tendencia_7_30', 'desviacion_lag1', 'coef_variacion',
+    'tendencia_7_14', 'tendencia_14_30',
+)
 
 
 # FUNCIONES DE PERSISTENCIA DE MODELOS
 
 def _obtener_ruta_modelo(plato_id: Optional[int] = None, modelo_tipo: str = 'auto') -> Path:
     """
-    Obtiene la ruta del archivo .pkl para un modelo específico
+    Obtiene la ruta del archivo .joblib para un modelo específico
     
     Args:
         plato_id: ID del plato (None para todos los platos)
         modelo_tipo: Tipo de modelo usado
     
     Returns:
-        Path al archivo .pkl
+        Path al archivo .joblib
     """
     if plato_id:
-        nombre_archivo = f"modelo_ventas_plato_{plato_id}_{modelo_tipo}.pkl"
+        nombre_archivo = f"modelo_ventas_plato_{plato_id}_{modelo_tipo}{EXTENSION_MODELO}"
     else:
-        nombre_archivo = f"modelo_ventas_todos_{modelo_tipo}.pkl"
+        nombre_archivo = f"modelo_ventas_todos_{modelo_tipo}{EXTENSION_MODELO}"
     
     return MODELS_DIR / nombre_archivo
 
@@ -85,16 +207,39 @@ def _obtener_ruta_metadata(plato_id: Optional[int] = None, modelo_tipo: str = 'a
         Path al archivo de metadata
     """
     if plato_id:
-        nombre_archivo = f"metadata_ventas_plato_{plato_id}_{modelo_tipo}.pkl"
+        nombre_archivo = f"metadata_ventas_plato_{plato_id}_{modelo_tipo}{EXTENSION_MODELO}"
     else:
-        nombre_archivo = f"metadata_ventas_todos_{modelo_tipo}.pkl"
+        nombre_archivo = f"metadata_ventas_todos_{modelo_tipo}{EXTENSION_MODELO}"
     
     return MODELS_DIR / nombre_archivo
 
 
+def _ruta_existente(ruta: Path) -> Optional[Path]:
+    """
+    Retorna la ruta si existe, o la versión .pkl antigua si solo existe esa
+    """
+    if ruta.exists():
+        return ruta
+    ruta_legada = ruta.with_suffix(EXTENSION_LEGADA)
+    if ruta_legada.exists():
+        return ruta_legada
+    return None
+
+
+def _leer_archivo_modelo(ruta: Path):
+    """
+    Lee un archivo guardado con joblib; si falla, intenta con pickle (archivos antiguos)
+    """
+    try:
+        return joblib.load(ruta)
+    except Exception:
+        with open(ruta, 'rb') as f:
+            return pickle.load(f)
+
+
 def guardar_modelo_entrenado(resultado_entrenamiento: Dict, plato_id: Optional[int] = None, modelo_tipo: str = 'auto') -> bool:
     """
-    Guarda un modelo entrenado y su metadata en archivos .pkl
+    Guarda un modelo entrenado y su metadata en archivos .joblib comprimidos
     
     Args:
         resultado_entrenamiento: Diccionario con el resultado de entrenar_modelo_ventas
@@ -104,7 +249,14 @@ def guardar_modelo_entrenado(resultado_entrenamiento: Dict, plato_id: Optional[i
     Returns:
         True si se guardó exitosamente, False en caso contrario
     """
+    global _directorio_modelos_creado
+    _MODEL_CACHE.pop((plato_id, modelo_tipo), None)
     try:
+        # Crear directorio si no existe (una sola vez por proceso)
+        if not _directorio_modelos_creado:
+            MODELS_DIR.mkdir(parents=True, exist_ok=True)
+            _directorio_modelos_creado = True
+        
         ruta_modelo = _obtener_ruta_modelo(plato_id, modelo_tipo)
         ruta_metadata = _obtener_ruta_metadata(plato_id, modelo_tipo)
         
@@ -117,8 +269,8 @@ def guardar_modelo_entrenado(resultado_entrenamiento: Dict, plato_id: Optional[i
             'features': resultado_entrenamiento.get('features', []),
         }
         
-        with open(ruta_modelo, 'wb') as f:
-            pickle.dump(modelo_data, f)
+        joblib.dump(modelo_data, ruta_modelo, compress=COMPRESION_MODELOS,
+                    protocol=pickle.HIGHEST_PROTOCOL)
         
         # Guardar metadata (métricas, fechas, etc.)
         metadata = {
@@ -131,10 +283,16 @@ def guardar_modelo_entrenado(resultado_entrenamiento: Dict, plato_id: Optional[i
             'mean_predicted': resultado_entrenamiento.get('mean_predicted', 0),
             'outliers_ajustados': resultado_entrenamiento.get('outliers_ajustados', 0),
             'plato_id': plato_id,
+            'firma_datos': resultado_entrenamiento.get('firma_datos'),
         }
         
-        with open(ruta_metadata, 'wb') as f:
-            pickle.dump(metadata, f)
+        joblib.dump(metadata, ruta_metadata, protocol=pickle.HIGHEST_PROTOCOL)
+        
+        # Quitar los .pkl antiguos para que no queden versiones desfasadas
+        for ruta in (ruta_modelo, ruta_metadata):
+            ruta_legada = ruta.with_suffix(EXTENSION_LEGADA)
+            if ruta_legada.exists():
+                ruta_legada.unlink()
         
         return True
     except Exception as e:
@@ -145,7 +303,7 @@ def guardar_modelo_entrenado(resultado_entrenamiento: Dict, plato_id: Optional[i
 def cargar_modelo_entrenado(plato_id: Optional[int] = None, modelo_tipo: str = 'auto', 
                             max_dias_antiguedad: int = 7) -> Optional[Dict]:
     """
-    Carga un modelo entrenado desde archivo .pkl si existe y no es muy antiguo
+    Carga un modelo entrenado desde archivo .joblib (o .pkl antiguo) si existe y no es muy antiguo
     
     Args:
         plato_id: ID del plato (None para todos)
@@ -156,28 +314,43 @@ def cargar_modelo_entrenado(plato_id: Optional[int] = None, modelo_tipo: str = '
     Returns:
         Diccionario con modelo y metadata si existe y es reciente, None en caso contrario
     """
+    clave = (plato_id, modelo_tipo)
     try:
-        ruta_modelo = _obtener_ruta_modelo(plato_id, modelo_tipo)
-        ruta_metadata = _obtener_ruta_metadata(plato_id, modelo_tipo)
+        # Reutilizar el modelo en memoria si el archivo no cambió desde que se cargó
+        en_cache = _MODEL_CACHE.get(clave)
+        if en_cache is not None:
+            ruta_cache, mtime_cache, cargado_en, resultado_cache = en_cache
+            try:
+                mtime_actual = ruta_cache.stat().st_mtime
+            except OSError:
+                mtime_actual = None
+            if mtime_actual == mtime_cache and time.time() - cargado_en < MODEL_CACHE_TTL:
+                dias_antiguedad = (datetime.now() - datetime.fromtimestamp(mtime_cache)).days
+                if dias_antiguedad > max_dias_antiguedad:
+                    return None
+                return {**resultado_cache, 'dias_antiguedad': dias_antiguedad}
+            _MODEL_CACHE.pop(clave, None)
+        
+        ruta_modelo = _ruta_existente(_obtener_ruta_modelo(plato_id, modelo_tipo))
+        ruta_metadata = _ruta_existente(_obtener_ruta_metadata(plato_id, modelo_tipo))
         
         # Verificar que ambos archivos existan
-        if not ruta_modelo.exists() or not ruta_metadata.exists():
+        if ruta_modelo is None or ruta_metadata is None:
             return None
         
         # Verificar antigüedad del modelo
-        fecha_modificacion = datetime.fromtimestamp(ruta_modelo.stat().st_mtime)
+        mtime_modelo = ruta_modelo.stat().st_mtime
+        fecha_modificacion = datetime.fromtimestamp(mtime_modelo)
         dias_antiguedad = (datetime.now() - fecha_modificacion).days
         
         if dias_antiguedad > max_dias_antiguedad:
             return None  # Modelo muy antiguo, necesita reentrenamiento
         
         # Cargar modelo
-        with open(ruta_modelo, 'rb') as f:
-            modelo_data = pickle.load(f)
+        modelo_data = _leer_archivo_modelo(ruta_modelo)
         
         # Cargar metadata
-        with open(ruta_metadata, 'rb') as f:
-            metadata = pickle.load(f)
+        metadata = _leer_archivo_modelo(ruta_metadata)
         
         # Combinar datos
         resultado = {
@@ -189,11 +362,14 @@ def cargar_modelo_entrenado(plato_id: Optional[int] = None, modelo_tipo: str = '
             'metricas': metadata.get('metricas', {}),
             'modelo_tipo': metadata.get('modelo_tipo', modelo_tipo),
             'fecha_entrenamiento': metadata.get('fecha_entrenamiento'),
+            'firma_datos': metadata.get('firma_datos'),
             'dias_antiguedad': dias_antiguedad,
             'cargado_desde_archivo': True,
         }
         
-        return resultado
+        _MODEL_CACHE[clave] = (ruta_modelo, mtime_modelo, time.time(), resultado)
+        
+        return dict(resultado)
         
     except Exception as e:
         print(f"Error al cargar modelo: {e}")
@@ -207,14 +383,20 @@ def eliminar_modelo_guardado(plato_id: Optional[int] = None, modelo_tipo: str =
     Returns:
         True si se eliminó exitosamente
     """
+    _MODEL_CACHE.pop((plato_id, modelo_tipo), None)
+    _MODELOS_COMPILADOS.pop((plato_id, modelo_tipo), None)
     try:
         ruta_modelo = _obtener_ruta_modelo(plato_id, modelo_tipo)
         ruta_metadata = _obtener_ruta_metadata(plato_id, modelo_tipo)
         
-        if ruta_modelo.exists():
-            ruta_modelo.unlink()
-        if ruta_metadata.exists():
-            ruta_metadata.unlink()
+        for ruta in (ruta_modelo, ruta_metadata):
+            for ruta_archivo in (ruta, ruta.with_suffix(EXTENSION_LEGADA)):
+                if ruta_archivo.exists():
+                    ruta_archivo.unlink()
+        
+        # Binarios compilados con lleaves
+        for ruta_so in ruta_modelo.parent.glob(f"{ruta_modelo.stem}_*.so"):
+            ruta_so.unlink()
         
         return True
     except Exception as e:
@@ -224,10 +406,11 @@ def eliminar_modelo_guardado(plato_id: Optional[int] = None, modelo_tipo: str =
 
 # PREPARACIÓN DE DATOS
 
-def _obtener_feriados_chile(año: int) -> set:
+@lru_cache(maxsize=32)
+def _obtener_feriados_chile(año: int) -> frozenset:
     """
     Obtiene fechas de feriados chilenos para un año específico
-    Feriados fijos y algunos comunes
+    Feriados fijos y algunos comunes. El resultado se cachea por año (inmutable)
     """
     feriados = set()
     
@@ -256,7 +439,115 @@ def _obtener_feriados_chile(año: int) -> set:
     elif año == 2026:
         feriados.add(date(año, 4, 3))
     
-    return feriados
+    return frozenset(feriados)
+
+
+@lru_cache(maxsize=16)
+def _feriados_ordinales(años: Tuple[int, ...]) -> np.ndarray:
+    """
+    Feriados de los años indicados como días desde 1970 (int64, ordenados), listos para
+    la búsqueda binaria del kernel de calendario. Se cachea por tupla de años (solo lectura)
+    """
+    feriados_todos = set()
+    for año in años:
+        feriados_todos.update(_obtener_feriados_chile(año))
+    feriados_ord = np.array(sorted(feriados_todos), dtype='datetime64[D]').astype(np.int64)
+    feriados_ord.flags.writeable = False
+    return feriados_ord
+
+
+def _features_calendario_numpy(fechas_ord: np.ndarray, feriados_ord: np.ndarray) -> Tuple[np.ndarray, ...]:
+    """
+    Features de calendario a partir de días desde 1970 y feriados ordenados (versión NumPy)
+    """
+    dia_semana = ((fechas_ord + 3) % 7).astype(np.int32)  # 1970-01-01 fue jueves
+    mes = (fechas_ord.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12 + 1).astype(np.int32)
+    
+    # Feriado siguiente (o el mismo día) y anterior por búsqueda binaria
+    idx = np.searchsorted(feriados_ord, fechas_ord, side='left')
+    hay_siguiente = idx < len(feriados_ord)
+    hay_anterior = idx > 0
+    siguiente = feriados_ord[np.minimum(idx, len(feriados_ord) - 1)] if len(feriados_ord) else fechas_ord
+    anterior = feriados_ord[np.maximum(idx - 1, 0)] if len(feriados_ord) else fechas_ord
+    dias_desde_feriado = np.where(hay_siguiente, siguiente - fechas_ord, 7).clip(max=7)
+    dias_hasta_feriado = np.where(hay_anterior, fechas_ord - anterior, 7).clip(max=7)
+    
+    return (
+        dia_semana, mes,
+        (dia_semana >= 5).astype(np.int8),
+        (hay_siguiente & (dias_desde_feriado == 0)).astype(np.int8),
+        dias_desde_feriado.astype(np.int64), dias_hasta_feriado.astype(np.int64),
+    )
+
+
+if NUMBA_DISPONIBLE:
+    @njit(cache=True)
+    def _construir_features_calendario(fechas_ord, feriados_ord):
+        """
+        Features de calendario a partir de días desde 1970 y feriados ordenados (compilado con Numba)
+        """
+        n = fechas_ord.shape[0]
+        n_feriados = feriados_ord.shape[0]
+        dia_semana = np.empty(n, np.int32)
+        mes = np.empty(n, np.int32)
+        es_fin_semana = np.empty(n, np.int8)
+        es_feriado = np.empty(n, np.int8)
+        dias_desde_feriado = np.empty(n, np.int64)
+        dias_hasta_feriado = np.empty(n, np.int64)
+        
+        for i in range(n):
+            dia = fechas_ord[i]
+            dow = (dia + 3) % 7  # 1970-01-01 fue jueves
+            
+            # Mes a partir del día (algoritmo civil_from_days)
+            z = dia + 719468
+            era = (z if z >= 0 else z - 146096) // 146097
+            doe = z - era * 146097
+            yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+            doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+            mp = (5 * doy + 2) // 153
+            m = mp + 3 if mp < 10 else mp - 9
+            
+            dia_semana[i] = dow
+            mes[i] = m
+            es_fin_semana[i] = 1 if dow >= 5 else 0
+            
+            # Búsqueda binaria del primer feriado >= dia
+            lo, hi = 0, n_feriados
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if feriados_ord[mid] < dia:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            desde = feriados_ord[lo] - dia if lo < n_feriados else 7
+            hasta = dia - feriados_ord[lo - 1] if lo > 0 else 7
+            es_feriado[i] = 1 if desde == 0 else 0
+            dias_desde_feriado[i] = min(desde, 7)
+            dias_hasta_feriado[i] = min(hasta, 7)
+        
+        return (dia_semana, mes, es_fin_semana, es_feriado, dias_desde_feriado, dias_hasta_feriado)
+else:
+    _construir_features_calendario = _features_calendario_numpy
+
+
+def _firma_ventas(plato_id: Optional[int] = None) -> tuple:
+    """
+    Firma barata de las ventas de un plato (o de todos): último id y total de PlatoProducido vendidos
+    """
+    ventas = PlatoProducido.objects.filter(estado='venta')
+    if plato_id:
+        ventas = ventas.filter(id_plato_id=plato_id)
+    firma = ventas.aggregate(ultimo=Max('pk'), total=Count('pk'))
+    return (firma['ultimo'], firma['total'])
+
+
+def _firma_datos_entrenamiento(plato_id: Optional[int], dias_historia: int) -> tuple:
+    """
+    Identifica los datos con que se entrena un modelo: días de historia, día en que termina la
+    ventana de entrenamiento y firma de ventas
+    """
+    return (dias_historia, date.today().toordinal()) + _firma_ventas(plato_id)
 
 
 def preparar_datos_ventas(plato_id: Optional[int] = None, dias_historia: int = 180) -> pd.DataFrame:
@@ -264,47 +555,88 @@ def preparar_datos_ventas(plato_id: Optional[int] = None, dias_historia: int = 1
     Prepara datos históricos de ventas para entrenamiento de modelos ML
     OPTIMIZADO: Usa cantidad total vendida en lugar de conteo de filas
     Incluye features de calendario avanzadas (feriados, día de pago, estacionalidad)
+    
+    El resultado se reutiliza durante el día mientras no cambien las ventas del plato
+    (último id y total de PlatoProducido vendidos); se entrega una copia en cada llamada.
+    """
+    hoy_ordinal = date.today().toordinal()
+    firma = _firma_ventas(plato_id)
+    
+    clave = (plato_id, dias_historia, hoy_ordinal)
+    en_cache = _DATA_CACHE.get(clave)
+    if en_cache is not None and en_cache[0] == firma:
+        return en_cache[1].copy()
+    
+    # Descartar entradas de días anteriores
+    for clave_vieja in [k for k in _DATA_CACHE if k[2] != hoy_ordinal]:
+        del _DATA_CACHE[clave_vieja]
+    
+    df = _construir_datos_ventas(plato_id, dias_historia)
+    _DATA_CACHE[clave] = (firma, df)
+    return df.copy()
+
+
+def _construir_datos_ventas(plato_id: Optional[int], dias_historia: int) -> pd.DataFrame:
+    """
+    Construye desde la BD el DataFrame de ventas diarias con sus features (sin caché)
     """
+    # Caso más común (un plato): camino especializado sin groupby ni merge
+    if plato_id:
+        return _preparar_datos_ventas_un_plato(plato_id, dias_historia)
+    
     hoy = date.today()
     fecha_inicio = hoy - timedelta(days=dias_historia)
     
     # Obtener ventas de múltiples fuentes para obtener cantidad real
     # IMPORTANTE: Usar solo PlatoProducido como fuente principal para evitar duplicación
     # Las otras fuentes pueden estar duplicando las mismas ventas
-    datos = []
     
     # Fuente principal: PlatoProducido (cada registro = 1 unidad vendida)
     # Esta es la fuente más confiable y evita duplicación
     ventas_pp = PlatoProducido.objects.filter(
         estado='venta',
         fecha_produccion__gte=fecha_inicio
-    ).select_related('id_plato')
-    
-    if plato_id:
-        ventas_pp = ventas_pp.filter(id_plato_id=plato_id)
-    
-    for venta in ventas_pp:
-        fecha = venta.fecha_produccion.date()
-        datos.append({
-            'fecha': fecha,
-            'plato_id': venta.id_plato.id_plato,
-            'plato_nombre': venta.id_plato.nombre_plato,
-            'cantidad': 1  # Cada PlatoProducido = 1 unidad
-        })
+    )
     
     # NOTA: No usar RegistroVentaPlato ni DetalleComanda aquí porque pueden duplicar
     # las mismas ventas que ya están en PlatoProducido. Si necesitas usar esas fuentes,
     # deberías hacer un join para evitar duplicación.
     
-    if not datos:
+    n_ventas = ventas_pp.count()
+    if not n_ventas:
         return pd.DataFrame()
     
-    df = pd.DataFrame(datos)
-    df['fecha'] = pd.to_datetime(df['fecha'])
-    df = df.sort_values('fecha')
+    # Leer en streaming a arreglos NumPy preasignados (sin lista de tuplas en memoria)
+    fechas = np.empty(n_ventas, dtype='datetime64[s]')
+    plato_ids = np.empty(n_ventas, dtype=np.int64)
+    n_leidas = 0
+    filas = ventas_pp.values_list('fecha_produccion', 'id_plato_id').iterator(chunk_size=FILAS_POR_LOTE_VENTAS)
+    for fecha, id_plato in filas:
+        if n_leidas == n_ventas:
+            break  # Llegaron ventas nuevas después del count()
+        if fecha.tzinfo is not None:
+            # Las fechas del ORM vienen en UTC; NumPy solo acepta fechas sin zona horaria
+            fecha = fecha.astimezone(dt_timezone.utc).replace(tzinfo=None)
+        fechas[n_leidas] = fecha
+        plato_ids[n_leidas] = id_plato
+        n_leidas += 1
+    fechas = fechas[:n_leidas]
+    plato_ids = plato_ids[:n_leidas]
+    
+    nombres_platos = dict(
+        Plato.objects.filter(pk__in=np.unique(plato_ids).tolist()).values_list('id_plato', 'nombre_plato')
+    )
+    
+    df = pd.DataFrame({'fecha': fechas, 'plato_id': plato_ids})
+    del fechas, plato_ids
+    df['plato_nombre'] = df['plato_id'].map(nombres_platos)
+    df['cantidad'] = 1  # Cada PlatoProducido = 1 unidad
+    # Día de la venta
+    df['fecha'] = df['fecha'].dt.normalize()
     
-    # Agrupar por día y plato SUMANDO cantidades (no contando filas)
-    if df['plato_id'].nunique() > 1:
+    # Agrupar por día y plato SUMANDO cantidades (no contando filas); groupby ya ordena por las claves
+    varios_platos = df['plato_id'].nunique() > 1
+    if varios_platos:
         df_agrupado = df.groupby(['fecha', 'plato_id', 'plato_nombre'])['cantidad'].sum().reset_index(name='ventas')
     else:
         # Si es un solo plato, agrupar solo por fecha
@@ -312,28 +644,26 @@ def preparar_datos_ventas(plato_id: Optional[int] = None, dias_historia: int = 1
         if 'plato_id' in df.columns and len(df) > 0:
             df_agrupado['plato_id'] = df['plato_id'].iloc[0]
             df_agrupado['plato_nombre'] = df['plato_nombre'].iloc[0]
+    # Las filas individuales ya no se necesitan: liberarlas antes de armar la serie completa
+    del df
     
     # Crear rango completo de fechas para incluir días sin ventas
+    # (date_range ya entrega datetime64, no hace falta convertir de nuevo)
     rango_fechas = pd.date_range(start=fecha_inicio, end=hoy, freq='D')
     df_completo = pd.DataFrame({'fecha': rango_fechas})
-    df_completo['fecha'] = pd.to_datetime(df_completo['fecha'])
     
     # Merge con datos reales (llenar con 0 los días sin ventas)
-    if df['plato_id'].nunique() > 1:
-        # Para múltiples platos, hacer merge por fecha y plato_id
-        df_completo = df_completo.merge(
-            df_agrupado[['fecha', 'plato_id', 'ventas']], 
-            on='fecha', 
+    if varios_platos:
+        # Para múltiples platos: producto cartesiano platos x fechas y un solo merge
+        # por (fecha, plato_id), así cada plato tiene su serie diaria completa.
+        # Con los platos ordenados, el resultado queda ordenado por (plato_id, fecha)
+        platos = df_agrupado[['plato_id', 'plato_nombre']].drop_duplicates('plato_id').sort_values('plato_id')
+        df_completo = platos.merge(df_completo, how='cross').merge(
+            df_agrupado[['fecha', 'plato_id', 'ventas']],
+            on=['fecha', 'plato_id'],
             how='left'
-        )
+        )[['fecha', 'plato_id', 'ventas', 'plato_nombre']]
         df_completo['ventas'] = df_completo['ventas'].fillna(0)
-        # Llenar plato_id y plato_nombre para días sin ventas
-        for plato_id in df_agrupado['plato_id'].unique():
-            mask = (df_completo['plato_id'].isna()) | (df_completo['plato_id'] == plato_id)
-            plato_nombre = df_agrupado[df_agrupado['plato_id'] == plato_id]['plato_nombre'].iloc[0]
-            df_completo.loc[mask, 'plato_id'] = plato_id
-            if 'plato_nombre' not in df_completo.columns:
-                df_completo['plato_nombre'] = plato_nombre
     else:
         # Para un solo plato, merge simple
         df_completo = df_completo.merge(df_agrupado[['fecha', 'ventas']], on='fecha', how='left')
@@ -342,102 +672,136 @@ def preparar_datos_ventas(plato_id: Optional[int] = None, dias_historia: int = 1
             df_completo['plato_id'] = df_agrupado['plato_id'].iloc[0]
             df_completo['plato_nombre'] = df_agrupado['plato_nombre'].iloc[0]
     
-    df_agrupado = df_completo.sort_values('fecha').reset_index(drop=True)
+    # df_completo ya está ordenado por (plato_id, fecha): no hace falta reordenarlo
+    del df_agrupado
+    if n_ventas > FILAS_PARA_GC:
+        gc.collect()
+    
+    return _agregar_features_ventas(df_completo)
+
+
+def _preparar_datos_ventas_un_plato(plato_id: int, dias_historia: int) -> pd.DataFrame:
+    """
+    Camino rápido de preparar_datos_ventas para un solo plato: cuenta las ventas
+    diarias con np.bincount sobre el rango de fechas, sin groupby ni merge
+    """
+    hoy = date.today()
+    fecha_inicio = hoy - timedelta(days=dias_historia)
+    
+    fechas = list(PlatoProducido.objects.filter(
+        estado='venta',
+        fecha_produccion__gte=fecha_inicio,
+        id_plato_id=plato_id
+    ).values_list('fecha_produccion', flat=True))
+    
+    if not fechas:
+        return pd.DataFrame()
+    
+    plato = Plato.objects.filter(pk=plato_id).values_list('id_plato', 'nombre_plato').first()
+    
+    # Día de cada venta (las fechas del ORM vienen en UTC) como desplazamiento desde fecha_inicio
+    rango_fechas = pd.date_range(start=fecha_inicio, end=hoy, freq='D')
+    dias_venta = pd.to_datetime(fechas, utc=True, cache=True).tz_localize(None).values.astype('datetime64[D]')
+    del fechas  # La lista de datetime de Python es lo más pesado; ya no se necesita
+    desplazamientos = (dias_venta - np.datetime64(fecha_inicio, 'D')).astype(np.int64)
+    desplazamientos = desplazamientos[(desplazamientos >= 0) & (desplazamientos < len(rango_fechas))]
+    
+    df_agrupado = pd.DataFrame({
+        'fecha': rango_fechas,
+        'ventas': np.bincount(desplazamientos, minlength=len(rango_fechas)).astype(np.float64),
+    })
+    df_agrupado['plato_id'] = plato[0] if plato else plato_id
+    df_agrupado['plato_nombre'] = plato[1] if plato else ''
+    
+    return _agregar_features_ventas(df_agrupado)
+
+
+def _agregar_features_ventas(df_agrupado: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrega las features de calendario, medias móviles y lags a la serie diaria de ventas
+    (espera las filas ordenadas por plato_id y fecha, con índice 0..n-1)
+    """
+    # Features de calendario: Feriados (arreglo cacheado por años presentes)
+    años = df_agrupado['fecha'].dt.year
+    feriados_ord = _feriados_ordinales(tuple(int(año) for año in np.unique(años.to_numpy())))
+    
+    # Fechas y feriados como días desde 1970 (int64): el cálculo se hace en un solo recorrido
+    fechas_ord = df_agrupado['fecha'].values.astype('datetime64[D]').astype(np.int64)
+    (dia_semana, mes, es_fin_semana, es_feriado,
+     dias_desde_feriado, dias_hasta_feriado) = _construir_features_calendario(fechas_ord, feriados_ord)
     
     # Agregar características temporales básicas
-    df_agrupado['dia_semana'] = df_agrupado['fecha'].dt.dayofweek
-    df_agrupado['mes'] = df_agrupado['fecha'].dt.month
-    df_agrupado['año'] = df_agrupado['fecha'].dt.year
+    df_agrupado['dia_semana'] = dia_semana
+    df_agrupado['mes'] = mes
+    df_agrupado['año'] = años
     df_agrupado['dia_mes'] = df_agrupado['fecha'].dt.day
     df_agrupado['semana_año'] = df_agrupado['fecha'].dt.isocalendar().week
     df_agrupado['trimestre'] = df_agrupado['fecha'].dt.quarter
     df_agrupado['dia_año'] = df_agrupado['fecha'].dt.dayofyear
     
-    # Features cíclicas (sin/cos) para capturar patrones temporales
-    df_agrupado['dia_semana_sin'] = np.sin(2 * np.pi * df_agrupado['dia_semana'] / 7)
-    df_agrupado['dia_semana_cos'] = np.cos(2 * np.pi * df_agrupado['dia_semana'] / 7)
-    df_agrupado['mes_sin'] = np.sin(2 * np.pi * df_agrupado['mes'] / 12)
-    df_agrupado['mes_cos'] = np.cos(2 * np.pi * df_agrupado['mes'] / 12)
-    df_agrupado['dia_mes_sin'] = np.sin(2 * np.pi * df_agrupado['dia_mes'] / 31)
-    df_agrupado['dia_mes_cos'] = np.cos(2 * np.pi * df_agrupado['dia_mes'] / 31)
-    df_agrupado['trimestre_sin'] = np.sin(2 * np.pi * df_agrupado['trimestre'] / 4)
-    df_agrupado['trimestre_cos'] = np.cos(2 * np.pi * df_agrupado['trimestre'] / 4)
-    df_agrupado['dia_año_sin'] = np.sin(2 * np.pi * df_agrupado['dia_año'] / 365.25)
-    df_agrupado['dia_año_cos'] = np.cos(2 * np.pi * df_agrupado['dia_año'] / 365.25)
+    # Features cíclicas (sin/cos) para capturar patrones temporales, leídas de las tablas
+    dia_mes = df_agrupado['dia_mes'].to_numpy()
+    trimestre = df_agrupado['trimestre'].to_numpy()
+    dia_año = df_agrupado['dia_año'].to_numpy()
+    df_agrupado['dia_semana_sin'] = _DOW_SIN[dia_semana]
+    df_agrupado['dia_semana_cos'] = _DOW_COS[dia_semana]
+    df_agrupado['mes_sin'] = _MES_SIN[mes]
+    df_agrupado['mes_cos'] = _MES_COS[mes]
+    df_agrupado['dia_mes_sin'] = _DOM_SIN[dia_mes]
+    df_agrupado['dia_mes_cos'] = _DOM_COS[dia_mes]
+    df_agrupado['trimestre_sin'] = _TRIM_SIN[trimestre]
+    df_agrupado['trimestre_cos'] = _TRIM_COS[trimestre]
+    df_agrupado['dia_año_sin'] = _DOY_SIN[dia_año]
+    df_agrupado['dia_año_cos'] = _DOY_COS[dia_año]
     
     # Features booleanas
-    df_agrupado['es_fin_semana'] = (df_agrupado['dia_semana'] >= 5).astype(int)
-    df_agrupado['es_inicio_mes'] = (df_agrupado['dia_mes'] <= 7).astype(int)
-    df_agrupado['es_mitad_mes'] = ((df_agrupado['dia_mes'] >= 14) & (df_agrupado['dia_mes'] <= 16)).astype(int)
-    df_agrupado['es_fin_mes'] = (df_agrupado['dia_mes'] >= 25).astype(int)
-    df_agrupado['es_lunes'] = (df_agrupado['dia_semana'] == 0).astype(int)
-    df_agrupado['es_viernes'] = (df_agrupado['dia_semana'] == 4).astype(int)
-    
-    # Features de calendario: Feriados
-    años_unicos = df_agrupado['año'].unique()
-    feriados_todos = set()
-    for año in años_unicos:
-        feriados_todos.update(_obtener_feriados_chile(int(año)))
-    
-    df_agrupado['fecha_date'] = df_agrupado['fecha'].dt.date
-    df_agrupado['es_feriado'] = df_agrupado['fecha_date'].isin(feriados_todos).astype(int)
+    df_agrupado['es_fin_semana'] = es_fin_semana
+    df_agrupado['es_inicio_mes'] = (df_agrupado['dia_mes'] <= 7).astype(np.int8)
+    df_agrupado['es_mitad_mes'] = ((df_agrupado['dia_mes'] >= 14) & (df_agrupado['dia_mes'] <= 16)).astype(np.int8)
+    df_agrupado['es_fin_mes'] = (df_agrupado['dia_mes'] >= 25).astype(np.int8)
+    df_agrupado['es_lunes'] = (df_agrupado['dia_semana'] == 0).astype(np.int8)
+    df_agrupado['es_viernes'] = (df_agrupado['dia_semana'] == 4).astype(np.int8)
+    df_agrupado['es_feriado'] = es_feriado
     
     # Features de calendario: Día de pago (típicamente días 5, 10, 15, 20, 25, último día del mes)
     # Días comunes de pago en Chile
     df_agrupado['es_dia_pago'] = (
         (df_agrupado['dia_mes'].isin([5, 10, 15, 20, 25])) |
         (df_agrupado['dia_mes'] >= 28)  # Últimos días del mes
-    ).astype(int)
-    
-    # Días antes/después de feriado (mayor consumo)
-    df_agrupado['dias_desde_feriado'] = 999
-    df_agrupado['dias_hasta_feriado'] = 999
-    for idx, row in df_agrupado.iterrows():
-        fecha_actual = row['fecha_date']
-        # Buscar feriado más cercano
-        feriados_cercanos = [f for f in feriados_todos if abs((f - fecha_actual).days) <= 7]
-        if feriados_cercanos:
-            dias_dif = [(f - fecha_actual).days for f in feriados_cercanos]
-            dias_desde = min([d for d in dias_dif if d >= 0], default=999)
-            dias_hasta = min([abs(d) for d in dias_dif if d < 0], default=999)
-            df_agrupado.at[idx, 'dias_desde_feriado'] = dias_desde if dias_desde != 999 else 7
-            df_agrupado.at[idx, 'dias_hasta_feriado'] = dias_hasta if dias_hasta != 999 else 7
+    ).astype(np.int8)
+    
+    # Días antes/después de feriado (mayor consumo), limitados a 7 igual que al predecir
+    df_agrupado['dias_desde_feriado'] = dias_desde_feriado
+    df_agrupado['dias_hasta_feriado'] = dias_hasta_feriado
     
     df_agrupado['cerca_feriado'] = ((df_agrupado['dias_desde_feriado'] <= 2) | 
-                                     (df_agrupado['dias_hasta_feriado'] <= 2)).astype(int)
+                                     (df_agrupado['dias_hasta_feriado'] <= 2)).astype(np.int8)
     
     # Estacionalidad: mes de verano/invierno (Chile: verano dic-feb, invierno jun-ago)
-    df_agrupado['es_verano'] = df_agrupado['mes'].isin([12, 1, 2]).astype(int)
-    df_agrupado['es_invierno'] = df_agrupado['mes'].isin([6, 7, 8]).astype(int)
-    df_agrupado['es_temporada_alta'] = df_agrupado['mes'].isin([12, 1, 2, 7, 8]).astype(int)  # Verano + vacaciones invierno
+    df_agrupado['es_verano'] = df_agrupado['mes'].isin([12, 1, 2]).astype(np.int8)
+    df_agrupado['es_invierno'] = df_agrupado['mes'].isin([6, 7, 8]).astype(np.int8)
+    df_agrupado['es_temporada_alta'] = df_agrupado['mes'].isin([12, 1, 2, 7, 8]).astype(np.int8)  # Verano + vacaciones invierno
     
     # Si hay múltiples platos, procesar por plato
     if df_agrupado['plato_id'].nunique() > 1:
-        df_final = []
-        for plato_id in df_agrupado['plato_id'].unique():
-            df_plato = df_agrupado[df_agrupado['plato_id'] == plato_id].copy()
-            df_plato = df_plato.sort_values('fecha').reset_index(drop=True)
-            
-            # Medias móviles (tendencias)
-            df_plato['media_movil_7'] = df_plato['ventas'].rolling(window=7, min_periods=1).mean()
-            df_plato['media_movil_14'] = df_plato['ventas'].rolling(window=14, min_periods=1).mean()
-            df_plato['media_movil_30'] = df_plato['ventas'].rolling(window=30, min_periods=1).mean()
-            
-            # Lag features (ventas de días anteriores)
-            df_plato['lag_1'] = df_plato['ventas'].shift(1).fillna(0)
-            df_plato['lag_7'] = df_plato['ventas'].shift(7).fillna(0)
-            df_plato['lag_14'] = df_plato['ventas'].shift(14).fillna(0)
-            
-            # Desviación estándar móvil (volatilidad)
-            df_plato['std_movil_7'] = df_plato['ventas'].rolling(window=7, min_periods=1).std().fillna(0)
-            
-            df_final.append(df_plato)
+        # Una sola pasada agrupada: las ventanas y desplazamientos se calculan
+        # por plato sin copiar ni concatenar un DataFrame por cada uno
+        ventas_plato = df_agrupado.groupby('plato_id', sort=False)['ventas']
+        
+        # Medias móviles (tendencias)
+        df_agrupado['media_movil_7'] = ventas_plato.rolling(window=7, min_periods=1).mean().reset_index(level=0, drop=True)
+        df_agrupado['media_movil_14'] = ventas_plato.rolling(window=14, min_periods=1).mean().reset_index(level=0, drop=True)
+        df_agrupado['media_movil_30'] = ventas_plato.rolling(window=30, min_periods=1).mean().reset_index(level=0, drop=True)
         
-        df_agrupado = pd.concat(df_final, ignore_index=True)
+        # Lag features (ventas de días anteriores)
+        df_agrupado['lag_1'] = ventas_plato.shift(1).fillna(0)
+        df_agrupado['lag_7'] = ventas_plato.shift(7).fillna(0)
+        df_agrupado['lag_14'] = ventas_plato.shift(14).fillna(0)
+        
+        # Desviación estándar móvil (volatilidad)
+        df_agrupado['std_movil_7'] = ventas_plato.rolling(window=7, min_periods=1).std().reset_index(level=0, drop=True).fillna(0)
     else:
         # Para un solo plato
-        df_agrupado = df_agrupado.sort_values('fecha').reset_index(drop=True)
-        
         # Medias móviles
         df_agrupado['media_movil_7'] = df_agrupado['ventas'].rolling(window=7, min_periods=1).mean()
         df_agrupado['media_movil_14'] = df_agrupado['ventas'].rolling(window=14, min_periods=1).mean()
@@ -451,19 +815,72 @@ def preparar_datos_ventas(plato_id: Optional[int] = None, dias_historia: int = 1
         # Desviación estándar móvil
         df_agrupado['std_movil_7'] = df_agrupado['ventas'].rolling(window=7, min_periods=1).std().fillna(0)
     
-    # Llenar NaN restantes y asegurar que no haya valores infinitos
-    df_agrupado = df_agrupado.fillna(0)
-    
-    # Reemplazar infinitos por NaN y luego llenar
-    df_agrupado = df_agrupado.replace([np.inf, -np.inf], np.nan)
-    df_agrupado = df_agrupado.fillna(0)
+    # Llenar NaN e infinitos en una sola pasada; solo las columnas float pueden tenerlos
+    float_cols = [c for c in df_agrupado.columns if df_agrupado[c].dtype == np.float64]
+    df_agrupado[float_cols] = np.nan_to_num(df_agrupado[float_cols].to_numpy(), nan=0.0, posinf=0.0, neginf=0.0)
     
     # Asegurar que las ventas no sean negativas
     df_agrupado['ventas'] = df_agrupado['ventas'].clip(lower=0)
     
+    # Los modelos de árboles no aprovechan más precisión que float32: reducir a la mitad
+    # la memoria que recorren al buscar cortes (las ventas se mantienen intactas)
+    float_cols.remove('ventas')
+    df_agrupado[float_cols] = df_agrupado[float_cols].astype(np.float32)
+    
     return df_agrupado
 
 
+def _features_calendario_futuras(fechas: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    Features de calendario (no dependen de las ventas) para fechas a predecir en datetime64[D],
+    con el mismo kernel y las mismas tablas sin/cos que el entrenamiento
+    """
+    indice = pd.DatetimeIndex(fechas)
+    años = indice.year.to_numpy()
+    feriados_ord = _feriados_ordinales(tuple(int(año) for año in np.unique(años)))
+    (dia_semana, mes, es_fin_semana, es_feriado,
+     dias_desde_feriado, dias_hasta_feriado) = _construir_features_calendario(fechas.astype(np.int64), feriados_ord)
+    
+    dia_mes = indice.day.to_numpy()
+    trimestre = indice.quarter.to_numpy()
+    dia_año = indice.dayofyear.to_numpy()
+    
+    return {
+        'dia_semana': dia_semana,
+        'mes': mes,
+        'año': años,
+        'dia_mes': dia_mes,
+        'semana_año': indice.isocalendar().week.to_numpy(dtype=np.int64),
+        'trimestre': trimestre,
+        'dia_año': dia_año,
+        'dia_semana_sin': _DOW_SIN[dia_semana],
+        'dia_semana_cos': _DOW_COS[dia_semana],
+        'mes_sin': _MES_SIN[mes],
+        'mes_cos': _MES_COS[mes],
+        'dia_mes_sin': _DOM_SIN[dia_mes],
+        'dia_mes_cos': _DOM_COS[dia_mes],
+        'trimestre_sin': _TRIM_SIN[trimestre],
+        'trimestre_cos': _TRIM_COS[trimestre],
+        'dia_año_sin': _DOY_SIN[dia_año],
+        'dia_año_cos': _DOY_COS[dia_año],
+        'es_fin_semana': es_fin_semana,
+        'es_inicio_mes': (dia_mes <= 7).astype(np.int8),
+        'es_mitad_mes': ((dia_mes >= 14) & (dia_mes <= 16)).astype(np.int8),
+        'es_fin_mes': (dia_mes >= 25).astype(np.int8),
+        'es_lunes': (dia_semana == 0).astype(np.int8),
+        'es_viernes': (dia_semana == 4).astype(np.int8),
+        'es_feriado': es_feriado,
+        'es_dia_pago': (np.isin(dia_mes, [5, 10, 15, 20, 25]) | (dia_mes >= 28)).astype(np.int8),
+        'dias_desde_feriado': dias_desde_feriado,
+        'dias_hasta_feriado': dias_hasta_feriado,
+        'cerca_feriado': ((dias_desde_feriado <= 2) | (dias_hasta_feriado <= 2)).astype(np.int8),
+        'es_verano': np.isin(mes, [12, 1, 2]).astype(np.int8),
+        'es_invierno': np.isin(mes, [6, 7, 8]).astype(np.int8),
+        'es_temporada_alta': np.isin(mes, [12, 1, 2, 7, 8]).astype(np.int8),
+        'fin_semana_mes': es_fin_semana * mes,
+    }
+
+
 def preparar_datos_demanda_insumos(insumo_id: Optional[int] = None, dias_historia: int = 180) -> pd.DataFrame:
     """
     Prepara datos históricos de consumo de insumos para predicción de demanda
@@ -556,12 +973,146 @@ def preparar_datos_mermas(dias_historia: int = 180) -> pd.DataFrame:
 
 # ========== MODELOS DE PREDICCIÓN DE VENTAS ==========
 
+def _predecir_modelo(modelo, X: np.ndarray) -> np.ndarray:
+    """
+    Predice con un estimador sklearn o con un Booster nativo de XGBoost/LightGBM
+    """
+    if XGBOOST_DISPONIBLE and isinstance(modelo, xgb.Booster):
+        # inplace_predict lee el array directamente, sin construir un DMatrix por llamada
+        return modelo.inplace_predict(np.asarray(X, dtype=np.float32)).astype(np.float64)
+    if LLEAVES_DISPONIBLE and isinstance(modelo, lleaves.Model):
+        # Predicciones de una fila: sin repartir entre hilos
+        return modelo.predict(np.asarray(X, dtype=np.float64), n_jobs=1)
+    return modelo.predict(X)
+
+
+def _compilar_modelos_ensemble(modelos: List, plato_id: Optional[int], modelo_tipo: str) -> List:
+    """
+    Reemplaza los Booster de LightGBM por su versión compilada con lleaves (el binario .so
+    queda junto al .joblib y se compila al entrenar; después solo se carga).
+    Si lleaves no está o la compilación falla, retorna los modelos originales
+    """
+    if not (LLEAVES_DISPONIBLE and LIGHTGBM_DISPONIBLE) or not any(isinstance(m, lgb.Booster) for m in modelos):
+        return modelos
+    
+    ruta_modelo = _obtener_ruta_modelo(plato_id, modelo_tipo)
+    if not ruta_modelo.exists():
+        return modelos
+    mtime = ruta_modelo.stat().st_mtime
+    
+    cache = _MODELOS_COMPILADOS.get((plato_id, modelo_tipo))
+    if cache is not None and cache[0] == mtime:
+        return cache[1]
+    
+    compilados = []
+    try:
+        for i, modelo in enumerate(modelos):
+            if not isinstance(modelo, lgb.Booster):
+                compilados.append(modelo)
+                continue
+            ruta_so = ruta_modelo.with_name(f"{ruta_modelo.stem}_{i}.so")
+            # lleaves no revisa si el binario está desfasado: solo cargar los posteriores al .joblib
+            binario_vigente = ruta_so.exists() and ruta_so.stat().st_mtime >= mtime
+            
+            # Archivos temporales con nombre único: varios workers pueden compilar el mismo modelo a la vez
+            with tempfile.NamedTemporaryFile(dir=ruta_modelo.parent, suffix='.txt', delete=False) as f:
+                ruta_txt = Path(f.name)
+            with tempfile.NamedTemporaryFile(dir=ruta_modelo.parent, suffix='.so') as f:
+                ruta_so_tmp = Path(f.name)  # Solo el nombre: lleaves cargaría un archivo existente
+            try:
+                modelo.save_model(str(ruta_txt))
+                compilado = lleaves.Model(model_file=str(ruta_txt))
+                # Un solo bloque con todos los árboles (recomendado para predecir de a una fila)
+                if binario_vigente:
+                    compilado.compile(cache=str(ruta_so), fblocksize=compilado.num_trees())
+                else:
+                    compilado.compile(cache=str(ruta_so_tmp), fblocksize=compilado.num_trees())
+                    # Reemplazo atómico: ningún proceso lee un binario a medio escribir
+                    os.replace(ruta_so_tmp, ruta_so)
+            finally:
+                ruta_txt.unlink(missing_ok=True)
+                ruta_so_tmp.unlink(missing_ok=True)
+            compilados.append(compilado)
+    except Exception as e:
+        # No reintentar hasta que cambie el modelo guardado
+        print(f"No se pudo compilar el modelo con lleaves: {e}")
+        compilados = modelos
+    
+    _MODELOS_COMPILADOS[(plato_id, modelo_tipo)] = (mtime, compilados)
+    return compilados
+
+
+def _codificar_plato(categorias_plato, plato_id) -> int:
+    """
+    Código de plato_id_encoded para un plato a partir de las categorías guardadas al entrenar
+    (acepta también el LabelEncoder de modelos guardados antes)
+    """
+    try:
+        if hasattr(categorias_plato, 'transform'):
+            return int(categorias_plato.transform([plato_id])[0])
+        idx = int(np.searchsorted(categorias_plato, plato_id))
+        if idx < len(categorias_plato) and categorias_plato[idx] == plato_id:
+            return idx
+    except (TypeError, ValueError):
+        pass
+    return 0
+
+
+def _suavizar_predicciones_numpy(y_pred: np.ndarray, y_test: np.ndarray, alpha: float) -> Tuple[np.ndarray, np.ndarray, float, float]:
+    """
+    Recorta las predicciones a >= 0, las suaviza con s[i] = alpha*y[i] + (1-alpha)*s[i-1]
+    y calcula el MAE de ambas versiones (versión NumPy)
+    """
+    y_pred = np.maximum(y_pred, 0)
+    y_suavizado = pd.Series(y_pred).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    return y_pred, y_suavizado, float(np.mean(np.abs(y_test - y_pred))), float(np.mean(np.abs(y_test - y_suavizado)))
+
+
+if NUMBA_DISPONIBLE:
+    @njit(cache=True)
+    def _suavizar_predicciones(y_pred, y_test, alpha):
+        """
+        Recorta las predicciones a >= 0, las suaviza con s[i] = alpha*y[i] + (1-alpha)*s[i-1]
+        y calcula el MAE de ambas versiones en una sola pasada (compilado con Numba)
+        """
+        n = y_pred.shape[0]
+        recortado = np.empty(n)
+        suavizado = np.empty(n)
+        suma_original = 0.0
+        suma_suavizado = 0.0
+        s = 0.0
+        for i in range(n):
+            y = max(y_pred[i], 0.0)
+            s = y if i == 0 else alpha * y + (1.0 - alpha) * s
+            recortado[i] = y
+            suavizado[i] = s
+            suma_original += abs(y_test[i] - y)
+            suma_suavizado += abs(y_test[i] - s)
+        return recortado, suavizado, suma_original / n, suma_suavizado / n
+else:
+    _suavizar_predicciones = _suavizar_predicciones_numpy
+
+
+def resolver_modelo_tipo(modelo_tipo: str) -> str:
+    """
+    Traduce 'auto' al mejor modelo disponible (el tipo con que se guarda el modelo entrenado)
+    LightGBM primero: más rápido en CPU con datos tabulares pequeños y maneja plato_id como categórica
+    """
+    if modelo_tipo != 'auto':
+        return modelo_tipo
+    if LIGHTGBM_DISPONIBLE:
+        return 'lightgbm'
+    if XGBOOST_DISPONIBLE:
+        return 'xgboost'
+    return 'random_forest'
+
+
 def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'auto', 
                           dias_historia: int = 365, forzar_reentrenamiento: bool = False) -> Dict:
     """
     Entrena un modelo ML mejorado para predecir ventas de platos
     OPTIMIZADO: Usa cantidad total vendida, features de calendario avanzadas, y modelos XGBoost/LightGBM
-    Ahora guarda y carga modelos desde archivos .pkl para mejorar rendimiento
+    Ahora guarda y carga modelos desde archivos .joblib para mejorar rendimiento
     
     Args:
         plato_id: ID del plato (opcional)
@@ -571,13 +1122,7 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
         forzar_reentrenamiento: Si True, ignora modelos guardados y reentrena (default: False)
     """
     # Selección automática del mejor modelo disponible
-    if modelo_tipo == 'auto':
-        if XGBOOST_DISPONIBLE:
-            modelo_tipo = 'xgboost'
-        elif LIGHTGBM_DISPONIBLE:
-            modelo_tipo = 'lightgbm'
-        else:
-            modelo_tipo = 'random_forest'
+    modelo_tipo = resolver_modelo_tipo(modelo_tipo)
     
     # Intentar cargar modelo guardado si no se fuerza reentrenamiento
     if not forzar_reentrenamiento:
@@ -585,6 +1130,9 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
         if modelo_cargado:
             return modelo_cargado
     
+    # Datos con que se entrena (se guarda en la metadata del modelo)
+    firma_datos = _firma_datos_entrenamiento(plato_id, dias_historia)
+    
     # Si no hay modelo guardado o se fuerza reentrenamiento, entrenar nuevo modelo
     df = preparar_datos_ventas(plato_id=plato_id, dias_historia=dias_historia)
     
@@ -598,97 +1146,77 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
     # Eliminar filas con NaN en features críticas
     df = df.dropna(subset=['ventas', 'fecha'])
     
+    # Últimas 30 ventas (antes de ajustar outliers) para que las predicciones no vuelvan a preparar los datos
+    ventas_recientes = df['ventas'].to_numpy()[-30:].tolist()
+    
     # Detectar y manejar outliers de forma muy conservadora
     # Solo ajustar valores extremos reales (más de 4 desviaciones estándar o percentil 99)
     outliers_ajustados = 0
     if len(df) > 20:  # Solo si hay suficientes datos
-        mean_ventas = df['ventas'].mean()
-        std_ventas = df['ventas'].std()
-        median_ventas = df['ventas'].median()
+        # Estadísticas sobre el arreglo NumPy (sin pasar por Series)
+        ventas = df['ventas'].to_numpy()
+        mean_ventas = ventas.mean()
+        std_ventas = ventas.std(ddof=1)  # Igual que Series.std()
         
         if std_ventas > 0:
+            median_ventas = np.median(ventas)
+            
             # Método muy conservador: solo ajustar valores extremos (percentil 99 o 4 desviaciones)
             # Esto preserva casi todos los datos
-            upper_bound_p99 = df['ventas'].quantile(0.99)
+            upper_bound_p99 = np.quantile(ventas, 0.99)
             upper_bound_z = mean_ventas + 4.0 * std_ventas  # 4 desviaciones estándar (muy conservador)
             upper_bound = min(upper_bound_p99, upper_bound_z)
             
             # Lower bound: solo valores negativos o muy por debajo de la mediana
             lower_bound = max(0, median_ventas - 2.0 * std_ventas)
             
-            # Solo ajustar valores que están realmente fuera de rango
-            ventas_original = df['ventas'].copy()
-            mask_outliers = (df['ventas'] < lower_bound) | (df['ventas'] > upper_bound)
-            
-            if mask_outliers.sum() > 0:
-                # Solo ajustar los outliers extremos
-                df.loc[mask_outliers, 'ventas'] = df.loc[mask_outliers, 'ventas'].clip(
-                    lower=lower_bound, 
-                    upper=upper_bound
-                )
-                outliers_ajustados = mask_outliers.sum()
-    
-    # Preparar features mejoradas (incluyendo nuevas features de calendario)
-    features = [
-        # Features temporales básicas
-        'dia_semana', 'mes', 'año', 'dia_mes', 'semana_año', 'trimestre', 'dia_año',
-        # Features cíclicas (sin/cos)
-        'dia_semana_sin', 'dia_semana_cos', 'mes_sin', 'mes_cos', 
-        'dia_mes_sin', 'dia_mes_cos', 'trimestre_sin', 'trimestre_cos',
-        'dia_año_sin', 'dia_año_cos',
-        # Features booleanas
-        'es_fin_semana', 'es_inicio_mes', 'es_mitad_mes', 'es_fin_mes',
-        'es_lunes', 'es_viernes',
-        # Features de calendario (NUEVAS)
-        'es_feriado', 'es_dia_pago', 'cerca_feriado',
-        'es_verano', 'es_invierno', 'es_temporada_alta',
-        'dias_desde_feriado', 'dias_hasta_feriado',
-        # Medias móviles (tendencias)
-        'media_movil_7', 'media_movil_14', 'media_movil_30',
-        # Lag features (ventas anteriores)
-        'lag_1', 'lag_7', 'lag_14',
-        # Volatilidad
-        'std_movil_7'
-    ]
+            # Solo ajustar valores que están realmente fuera de rango (np.any corta en el primero)
+            if np.any(ventas > upper_bound) or np.any(ventas < lower_bound):
+                mask_outliers = (ventas < lower_bound) | (ventas > upper_bound)
+                df.loc[mask_outliers, 'ventas'] = ventas[mask_outliers].clip(lower_bound, upper_bound)
+                outliers_ajustados = int(mask_outliers.sum())
+    
+    # Features base presentes en el DataFrame (búsqueda O(1) en un frozenset)
+    columnas = frozenset(df.columns)
+    features_disponibles = [f for f in _FEATURES_BASE_VENTAS if f in columnas]
     
     # Agregar features de ingeniería avanzadas
-    if 'media_movil_7' in df.columns and 'media_movil_30' in df.columns:
+    if {'media_movil_7', 'media_movil_30'} <= columnas:
         # Ratio de tendencias (corto vs largo plazo)
         df['ratio_tendencia_7_30'] = df['media_movil_7'] / (df['media_movil_30'] + 1e-8)
-        features.append('ratio_tendencia_7_30')
+        features_disponibles.append('ratio_tendencia_7_30')
     
-    if 'lag_1' in df.columns and 'media_movil_7' in df.columns:
+    if {'lag_1', 'media_movil_7'} <= columnas:
         # Desviación del lag respecto a la media
         df['desviacion_lag1'] = df['lag_1'] - df['media_movil_7']
-        features.append('desviacion_lag1')
+        features_disponibles.append('desviacion_lag1')
     
-    if 'std_movil_7' in df.columns and 'media_movil_7' in df.columns:
+    if {'std_movil_7', 'media_movil_7'} <= columnas:
         # Coeficiente de variación (volatilidad relativa)
         df['coef_variacion'] = df['std_movil_7'] / (df['media_movil_7'] + 1e-8)
-        features.append('coef_variacion')
+        features_disponibles.append('coef_variacion')
     
     # Interacción: fin de semana * mes (patrones estacionales)
-    if 'es_fin_semana' in df.columns and 'mes' in df.columns:
+    if {'es_fin_semana', 'mes'} <= columnas:
         df['fin_semana_mes'] = df['es_fin_semana'] * df['mes']
-        features.append('fin_semana_mes')
+        features_disponibles.append('fin_semana_mes')
     
     # Tendencia: diferencia entre medias móviles
-    if 'media_movil_7' in df.columns and 'media_movil_14' in df.columns:
+    if {'media_movil_7', 'media_movil_14'} <= columnas:
         df['tendencia_7_14'] = df['media_movil_7'] - df['media_movil_14']
-        features.append('tendencia_7_14')
+        features_disponibles.append('tendencia_7_14')
     
-    if 'media_movil_14' in df.columns and 'media_movil_30' in df.columns:
+    if {'media_movil_14', 'media_movil_30'} <= columnas:
         df['tendencia_14_30'] = df['media_movil_14'] - df['media_movil_30']
-        features.append('tendencia_14_30')
-    
-    # Verificar que todas las features existan
-    features_disponibles = [f for f in features if f in df.columns]
+        features_disponibles.append('tendencia_14_30')
     
     # Si hay múltiples platos, agregar plato_id como feature
     le_plato = None
     if 'plato_id' in df.columns and df['plato_id'].nunique() > 1:
-        le_plato = LabelEncoder()
-        df['plato_id_encoded'] = le_plato.fit_transform(df['plato_id'])
+        # Códigos por factorización en C; las categorías (ordenadas) se guardan para predecir
+        categorias = pd.Categorical(df['plato_id'])
+        df['plato_id_encoded'] = categorias.codes.astype(np.int16)
+        le_plato = categorias.categories.to_numpy()
         features_disponibles.append('plato_id_encoded')
     
     # Filtrar filas con NaN en features
@@ -701,8 +1229,10 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
             'metricas': {}
         }
     
-    X = df_clean[features_disponibles].values
-    y = df_clean['ventas'].values
+    # Matriz en float32 (las features ya vienen en float32): los árboles de sklearn, XGBoost y
+    # LightGBM trabajan en float32 y la reciben sin convertirla ni copiarla de nuevo
+    X = df_clean[features_disponibles].to_numpy(dtype=np.float32)
+    y = df_clean['ventas'].to_numpy(dtype=np.float64)
     
     # División TEMPORAL (no aleatoria) - usar últimos 20% para prueba
     # Esto es crucial para series temporales
@@ -725,22 +1255,29 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
     
     if modelo_tipo == 'xgboost':
         if XGBOOST_DISPONIBLE:
-            modelo = xgb.XGBRegressor(
-                n_estimators=300,
-                max_depth=8,
-                learning_rate=0.05,
-                subsample=0.8,
-                colsample_bytree=0.8,
-                min_child_weight=3,
-                gamma=0.1,
-                reg_alpha=0.1,
-                reg_lambda=1.0,
-                random_state=42,
-                n_jobs=-1,
-                tree_method='hist'  # Más rápido
-            )
-            modelo.fit(X_train, y_train)
-            y_pred = modelo.predict(X_test)
+            params_xgb = {
+                'objective': 'reg:squarederror',
+                'max_depth': 8,
+                'learning_rate': 0.05,
+                'subsample': 0.8,
+                'colsample_bytree': 0.8,
+                'min_child_weight': 3,
+                'gamma': 0.1,
+                'reg_alpha': 0.1,
+                'reg_lambda': 1.0,
+                'seed': 42,
+                'tree_method': 'hist',  # Más rápido
+                'device': 'cuda' if XGBOOST_GPU else 'cpu',
+                'nthread': _N_JOBS
+            }
+            # DMatrix nativo en float32 construido una sola vez (sin la conversión del wrapper sklearn)
+            dtrain = xgb.DMatrix(X_train, label=y_train)
+            modelo = xgb.train(params_xgb, dtrain, num_boost_round=300)
+            if XGBOOST_GPU:
+                # Las predicciones son de pocas filas con datos en CPU: predecir en CPU
+                # (también evita el aviso al cargar el modelo en un equipo sin GPU)
+                modelo.set_param({'device': 'cpu'})
+            y_pred = _predecir_modelo(modelo, X_test)
             modelos_ensemble = [modelo]
         else:
             # Fallback a RandomForest si XGBoost no está disponible
@@ -749,28 +1286,86 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
     
     elif modelo_tipo == 'lightgbm':
         if LIGHTGBM_DISPONIBLE:
-            modelo = lgb.LGBMRegressor(
-                n_estimators=300,
-                max_depth=8,
-                learning_rate=0.05,
-                subsample=0.8,
-                colsample_bytree=0.8,
-                min_child_samples=20,
-                reg_alpha=0.1,
-                reg_lambda=1.0,
-                random_state=42,
-                n_jobs=-1,
-                verbose=-1
+            # Parámetros para pocos datos (30-365 días por plato)
+            params_lgb = {
+                'objective': 'regression',
+                'max_depth': 8,
+                'num_leaves': 31,
+                'learning_rate': 0.05,
+                'min_data_in_leaf': 5,
+                'feature_fraction': 0.9,
+                'bagging_fraction': 0.8,
+                'bagging_freq': 1,
+                'reg_alpha': 0.1,
+                'reg_lambda': 1.0,
+                'random_state': 42,
+                'n_jobs': _N_JOBS,
+                'verbose': -1
+            }
+            # Dataset nativo en float32 construido una sola vez; plato_id_encoded como categórica
+            dtrain = lgb.Dataset(
+                X_train, label=y_train,
+                feature_name=features_disponibles,
+                categorical_feature=['plato_id_encoded'] if 'plato_id_encoded' in features_disponibles else 'auto',
+                free_raw_data=False
             )
-            modelo.fit(X_train, y_train)
-            y_pred = modelo.predict(X_test)
+            # Sin valid_sets: no se evalúa sobre el set de entrenamiento en cada iteración
+            modelo = lgb.train(params_lgb, dtrain, num_boost_round=300)
+            y_pred = _predecir_modelo(modelo, X_test)
             modelos_ensemble = [modelo]
         else:
             # Fallback a GradientBoosting si LightGBM no está disponible
             modelo_tipo = 'gradient_boosting'
             modelo_usado = 'gradient_boosting (fallback)'
     
-    if modelo_tipo == 'random_forest':
+    if modelo_tipo == 'random_forest' and LIGHTGBM_DISPONIBLE:
+        # RandomForest y GradientBoosting con LightGBM: un único Dataset binarizado
+        # compartido por ambos entrenamientos (histogramas en lugar de splits exactos)
+        dtrain = lgb.Dataset(
+            X_train, label=y_train,
+            feature_name=features_disponibles,
+            categorical_feature=['plato_id_encoded'] if 'plato_id_encoded' in features_disponibles else 'auto',
+            free_raw_data=False
+        )
+        params_rf = {
+            'objective': 'regression',
+            'boosting': 'rf',
+            'max_depth': 12,
+            'min_data_in_leaf': 4,
+            'bagging_fraction': 0.8,  # El modo rf exige bagging
+            'bagging_freq': 1,
+            'feature_fraction': 0.8,
+            'seed': 42,
+            'n_jobs': _N_JOBS,
+            'verbose': -1
+        }
+        modelo = lgb.train(params_rf, dtrain, num_boost_round=300)
+        y_pred = _predecir_modelo(modelo, X_test)
+        
+        # Ensemble: agregar GradientBoosting como segundo modelo
+        if len(X_train) > 50:
+            params_gb = {
+                'objective': 'regression',
+                'boosting': 'gbdt',
+                'max_depth': 5,
+                'learning_rate': 0.05,
+                'min_data_in_leaf': 5,
+                'bagging_fraction': 0.8,
+                'bagging_freq': 1,
+                'seed': 42,
+                'n_jobs': _N_JOBS,
+                'verbose': -1
+            }
+            modelo_gb = lgb.train(params_gb, dtrain, num_boost_round=100)
+            y_pred_gb = _predecir_modelo(modelo_gb, X_test)
+            
+            # Promedio ponderado: 70% RF, 30% GB
+            y_pred = 0.7 * y_pred + 0.3 * y_pred_gb
+            modelos_ensemble = [modelo, modelo_gb]
+        else:
+            modelos_ensemble = [modelo]
+    
+    elif modelo_tipo == 'random_forest':
         # Hiperparámetros optimizados para RandomForest (mejor balance bias-varianza)
         modelo = RandomForestRegressor(
             n_estimators=300,      # Aumentado para mejor generalización
@@ -781,19 +1376,20 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
             bootstrap=True,
             oob_score=True,        # Out-of-bag scoring para validación
             random_state=42,
-            n_jobs=-1
+            n_jobs=_N_JOBS
         )
         modelo.fit(X_train, y_train)
         y_pred = modelo.predict(X_test)
         
         # Ensemble: agregar GradientBoosting como segundo modelo
         if len(X_train) > 50:
-            modelo_gb = GradientBoostingRegressor(
-                n_estimators=100,
+            modelo_gb = HistGradientBoostingRegressor(
+                max_iter=100,
                 max_depth=5,
                 learning_rate=0.05,  # Learning rate más bajo para mejor generalización
-                min_samples_split=10,
-                subsample=0.8,       # Subsampling para reducir overfitting
+                min_samples_leaf=10,
+                l2_regularization=1.0,  # Regularización en lugar del subsampling
+                early_stopping=False,   # Siempre max_iter árboles (sin separar validación aleatoria)
                 random_state=42
             )
             modelo_gb.fit(X_train, y_train)
@@ -806,12 +1402,14 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
             modelos_ensemble = [modelo]
             
     elif modelo_tipo == 'gradient_boosting':
-        modelo = GradientBoostingRegressor(
-            n_estimators=200,      # Aumentado
+        # Versión por histogramas: agrupa cada feature en bins una sola vez antes de construir los árboles
+        modelo = HistGradientBoostingRegressor(
+            max_iter=200,          # Aumentado
             max_depth=5,           # Profundidad moderada
             learning_rate=0.05,   # Learning rate más bajo
-            min_samples_split=10,
-            subsample=0.8,
+            min_samples_leaf=10,
+            l2_regularization=1.0,
+            early_stopping=False,
             random_state=42
         )
         modelo.fit(X_train, y_train)
@@ -819,49 +1417,52 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
         modelos_ensemble = [modelo]
         
     elif modelo_tipo == 'ridge':
+        # Los modelos lineales se resuelven en float64 (features colineales, p. ej. las tendencias)
         scaler = StandardScaler()
-        X_train_scaled = scaler.fit_transform(X_train)
-        X_test_scaled = scaler.transform(X_test)
+        X_train_scaled = scaler.fit_transform(X_train.astype(np.float64))
+        X_test_scaled = scaler.transform(X_test.astype(np.float64))
         modelo = Ridge(alpha=5.0)  # Alpha optimizado
         modelo.fit(X_train_scaled, y_train)
         y_pred = modelo.predict(X_test_scaled)
         modelos_ensemble = [modelo]
-    else:
+    elif modelo_tipo not in ('xgboost', 'lightgbm'):
+        # XGBoost/LightGBM ya se entrenaron arriba; no sobrescribirlos con la regresión lineal
         scaler = StandardScaler()
-        X_train_scaled = scaler.fit_transform(X_train)
-        X_test_scaled = scaler.transform(X_test)
+        X_train_scaled = scaler.fit_transform(X_train.astype(np.float64))
+        X_test_scaled = scaler.transform(X_test.astype(np.float64))
         modelo = LinearRegression()
         modelo.fit(X_train_scaled, y_train)
         y_pred = modelo.predict(X_test_scaled)
         modelos_ensemble = [modelo]
     
     # Evaluar modelo
-    # Asegurar que las predicciones no sean negativas
-    y_pred = np.maximum(y_pred, 0)
-    
     # Aplicar suavizado si hay mucha variabilidad (reduce MAE)
     if len(y_pred) > 1:
-        # Suavizado exponencial simple para reducir ruido
-        alpha = 0.3
-        y_pred_suavizado = np.copy(y_pred)
-        for i in range(1, len(y_pred_suavizado)):
-            y_pred_suavizado[i] = alpha * y_pred[i] + (1 - alpha) * y_pred_suavizado[i-1]
+        # Predicciones no negativas, suavizado exponencial simple para reducir ruido
+        # y MAE de ambas versiones, calculados en un solo recorrido
+        y_pred, y_pred_suavizado, mae_original, mae_suavizado = _suavizar_predicciones(
+            np.ascontiguousarray(y_pred, dtype=np.float64), y_test, 0.3
+        )
         
         # Usar el que tenga mejor MAE
-        mae_original = mean_absolute_error(y_test, y_pred)
-        mae_suavizado = mean_absolute_error(y_test, y_pred_suavizado)
-        
         if mae_suavizado < mae_original:
             y_pred = y_pred_suavizado
+            mae = mae_suavizado
+        else:
+            mae = mae_original
+    else:
+        # Asegurar que las predicciones no sean negativas
+        y_pred = np.maximum(y_pred, 0)
+        mae = mean_absolute_error(y_test, y_pred)
     
-    mae = mean_absolute_error(y_test, y_pred)
     rmse = np.sqrt(mean_squared_error(y_test, y_pred))
     r2 = r2_score(y_test, y_pred)
     
     # Calcular métricas adicionales
     mean_y = np.mean(y_test)
     if mean_y > 0:
-        mape = np.mean(np.abs((y_test - y_pred) / (mean_y + 1e-8))) * 100
+        # El denominador es la media (escalar): mean(|y_test - y_pred|) / mean_y es el MAE ya calculado
+        mape = mae / (mean_y + 1e-8) * 100
     else:
         mape = 0
     
@@ -884,197 +1485,190 @@ def entrenar_modelo_ventas(plato_id: Optional[int] = None, modelo_tipo: str = 'a
         'mean_predicted': round(np.mean(y_pred), 2),
         'usar_ensemble': len(modelos_ensemble) > 1,
         'outliers_ajustados': outliers_ajustados if 'outliers_ajustados' in locals() else 0,
+        'ventas_recientes': ventas_recientes,  # Solo en memoria: no se guarda con el modelo
+        'firma_datos': firma_datos,
         'cargado_desde_archivo': False
     }
     
-    # Guardar modelo en archivo .pkl
-    guardar_modelo_entrenado(resultado, plato_id, modelo_usado)
+    # Guardar modelo en archivo .joblib y compilarlo ya con lleaves (si está disponible),
+    # para que la primera predicción solo cargue el binario
+    if guardar_modelo_entrenado(resultado, plato_id, modelo_usado):
+        _compilar_modelos_ensemble(modelos_ensemble, plato_id, modelo_usado)
     
     return resultado
 
 
-def predecir_ventas_futuras(plato_id: Optional[int] = None, dias_prediccion: int = 7, modelo_tipo: str = 'auto', dias_historia: int = 365) -> List[Dict]:
+def _obtener_ventas_recientes(resultado_entrenamiento: Dict, plato_id: Optional[int], dias_historia: int) -> List[float]:
     """
-    Predice ventas futuras usando modelos ML mejorados
-    Calcula features temporales avanzadas (medias móviles, lags) usando datos históricos
-    
-    Args:
-        plato_id: ID del plato (opcional)
-        dias_prediccion: Días a predecir
-        modelo_tipo: Tipo de modelo ML
-        dias_historia: Días de historia a usar para entrenar (default: 365)
+    Últimas 30 ventas diarias: las del entrenamiento recién hecho o, si el modelo se cargó
+    desde archivo, las de los datos actuales
     """
-    resultado_entrenamiento = entrenar_modelo_ventas(plato_id=plato_id, modelo_tipo=modelo_tipo, dias_historia=dias_historia)
-    
-    if resultado_entrenamiento['modelo'] is None:
-        return []
+    ventas_recientes = resultado_entrenamiento.get('ventas_recientes')
+    if ventas_recientes is not None:
+        return ventas_recientes
+    df_historico = preparar_datos_ventas(plato_id=plato_id, dias_historia=dias_historia)
+    return df_historico['ventas'].to_numpy()[-30:].tolist() if not df_historico.empty else []
+
+
+def _predecir_dias_futuros(resultado_entrenamiento: Dict, modelos_ensemble: List, plato_id: Optional[int],
+                           fecha_inicio: date, n_dias: int, ventas_recientes: List[float]) -> Tuple[List[float], np.ndarray]:
+    """
+    Predice las ventas de n_dias consecutivos desde fecha_inicio
+    Las features de calendario se calculan para todos los días de una vez; las medias móviles
+    y lags dependen de la predicción anterior y se completan día a día
     
-    modelos_ensemble = resultado_entrenamiento.get('modelos_ensemble', [resultado_entrenamiento['modelo']])
-    usar_ensemble = resultado_entrenamiento.get('usar_ensemble', False)
+    Returns:
+        (ventas predichas por día, es_fin_semana por día)
+    """
     features = resultado_entrenamiento['features']
     scaler = resultado_entrenamiento.get('scaler')
     le_plato = resultado_entrenamiento.get('label_encoder')
+    usar_ensemble = resultado_entrenamiento.get('usar_ensemble', False) and len(modelos_ensemble) > 1
+    columna = {f: j for j, f in enumerate(features)}
     
-    # Obtener datos históricos recientes para calcular medias móviles y lags
-    df_historico = preparar_datos_ventas(plato_id=plato_id, dias_historia=dias_historia)
-    
-    if df_historico.empty:
-        return []
-    
-    # Obtener las últimas 30 filas para calcular features temporales
-    df_reciente = df_historico.tail(30).copy()
-    ventas_recientes = df_reciente['ventas'].values.tolist()
+    # Posición en _FEATURES_AUTORREGRESIVAS -> columna de X, solo para las que usa el modelo
+    columnas_autorregresivas = [(k, columna[f]) for k, f in enumerate(_FEATURES_AUTORREGRESIVAS) if f in columna]
     
-    # Calcular medias móviles históricas
+    # Valores de respaldo mientras no haya suficientes ventas recientes
     media_movil_7_hist = np.mean(ventas_recientes[-7:]) if len(ventas_recientes) >= 7 else np.mean(ventas_recientes) if ventas_recientes else 0
     media_movil_14_hist = np.mean(ventas_recientes[-14:]) if len(ventas_recientes) >= 14 else np.mean(ventas_recientes) if ventas_recientes else 0
     media_movil_30_hist = np.mean(ventas_recientes[-30:]) if len(ventas_recientes) >= 30 else np.mean(ventas_recientes) if ventas_recientes else 0
     std_movil_7_hist = np.std(ventas_recientes[-7:]) if len(ventas_recientes) >= 7 else 0
     
-    # Generar fechas futuras
-    hoy = date.today()
-    predicciones = []
-    
-    for i in range(1, dias_prediccion + 1):
-        fecha_futura = hoy + timedelta(days=i)
-        
-        # Preparar features básicas temporales
-        feature_dict = {
-            'dia_semana': fecha_futura.weekday(),
-            'mes': fecha_futura.month,
-            'año': fecha_futura.year,
-            'dia_mes': fecha_futura.day,
-            'semana_año': fecha_futura.isocalendar()[1],
-            'trimestre': (fecha_futura.month - 1) // 3 + 1,
-            'dia_año': fecha_futura.timetuple().tm_yday,
-            'es_fin_semana': 1 if fecha_futura.weekday() >= 5 else 0,
-            'es_inicio_mes': 1 if fecha_futura.day <= 7 else 0,
-            'es_mitad_mes': 1 if 14 <= fecha_futura.day <= 16 else 0,
-            'es_fin_mes': 1 if fecha_futura.day >= 25 else 0,
-            'es_lunes': 1 if fecha_futura.weekday() == 0 else 0,
-            'es_viernes': 1 if fecha_futura.weekday() == 4 else 0,
-        }
-        
-        # Features cíclicas
-        feature_dict['dia_semana_sin'] = np.sin(2 * np.pi * feature_dict['dia_semana'] / 7)
-        feature_dict['dia_semana_cos'] = np.cos(2 * np.pi * feature_dict['dia_semana'] / 7)
-        feature_dict['mes_sin'] = np.sin(2 * np.pi * feature_dict['mes'] / 12)
-        feature_dict['mes_cos'] = np.cos(2 * np.pi * feature_dict['mes'] / 12)
-        feature_dict['dia_mes_sin'] = np.sin(2 * np.pi * feature_dict['dia_mes'] / 31)
-        feature_dict['dia_mes_cos'] = np.cos(2 * np.pi * feature_dict['dia_mes'] / 31)
-        feature_dict['trimestre_sin'] = np.sin(2 * np.pi * feature_dict['trimestre'] / 4)
-        feature_dict['trimestre_cos'] = np.cos(2 * np.pi * feature_dict['trimestre'] / 4)
-        feature_dict['dia_año_sin'] = np.sin(2 * np.pi * feature_dict['dia_año'] / 365.25)
-        feature_dict['dia_año_cos'] = np.cos(2 * np.pi * feature_dict['dia_año'] / 365.25)
-        
-        # Features de calendario: Feriados
-        feriados_año = _obtener_feriados_chile(fecha_futura.year)
-        feature_dict['es_feriado'] = 1 if fecha_futura in feriados_año else 0
-        
-        # Features de calendario: Día de pago
-        feature_dict['es_dia_pago'] = 1 if (fecha_futura.day in [5, 10, 15, 20, 25] or fecha_futura.day >= 28) else 0
-        
-        # Días desde/hasta feriado
-        feriados_cercanos = [f for f in feriados_año if abs((f - fecha_futura).days) <= 7]
-        if feriados_cercanos:
-            dias_dif = [(f - fecha_futura).days for f in feriados_cercanos]
-            dias_desde = min([d for d in dias_dif if d >= 0], default=7)
-            dias_hasta = min([abs(d) for d in dias_dif if d < 0], default=7)
-            feature_dict['dias_desde_feriado'] = dias_desde if dias_desde != 7 else 7
-            feature_dict['dias_hasta_feriado'] = dias_hasta if dias_hasta != 7 else 7
-        else:
-            feature_dict['dias_desde_feriado'] = 7
-            feature_dict['dias_hasta_feriado'] = 7
-        
-        feature_dict['cerca_feriado'] = 1 if (feature_dict['dias_desde_feriado'] <= 2 or feature_dict['dias_hasta_feriado'] <= 2) else 0
-        
-        # Estacionalidad
-        feature_dict['es_verano'] = 1 if fecha_futura.month in [12, 1, 2] else 0
-        feature_dict['es_invierno'] = 1 if fecha_futura.month in [6, 7, 8] else 0
-        feature_dict['es_temporada_alta'] = 1 if fecha_futura.month in [12, 1, 2, 7, 8] else 0
+    # Matriz (n_dias, features): columnas de calendario completas en una sola pasada
+    inicio = np.datetime64(fecha_inicio, 'D')
+    fechas = inicio + np.arange(n_dias)
+    calendario = _features_calendario_futuras(fechas)
+    X_futuro_todos = np.zeros((n_dias, len(features)))
+    for f, j in columna.items():
+        if f in calendario:
+            X_futuro_todos[:, j] = calendario[f]
+    
+    # Plato ID encoded (constante para todo el período)
+    if plato_id and le_plato is not None and 'plato_id_encoded' in columna:
+        X_futuro_todos[:, columna['plato_id_encoded']] = _codificar_plato(le_plato, plato_id)
+    
+    ventas_predichas_dias = []
+    
+    # Sumas de las ventanas de 7, 14 y 30 días (y de cuadrados para la desviación de 7):
+    # se actualizan en O(1) con cada predicción en lugar de recorrer las ventanas cada día.
+    # Las ventas son unidades enteras y las predicciones se redondean a un decimal, así que
+    # se acumulan en décimas enteras: sumas exactas, sin error acumulado de punto flotante
+    decimas = [round(v * 10) for v in ventas_recientes]
+    suma_7 = sum(decimas[-7:])
+    suma_14 = sum(decimas[-14:])
+    suma_30 = sum(decimas[-30:])
+    suma_cuad_7 = sum(d * d for d in decimas[-7:])
+    
+    # Últimos 30 días: deque con maxlen descarta el más antiguo al agregar, sin desplazar la lista
+    ventas_recientes = deque(ventas_recientes, maxlen=30)
+    decimas = deque(decimas, maxlen=30)
+    
+    for i in range(n_dias):
+        n_recientes = len(ventas_recientes)
         
         # Calcular medias móviles usando ventas recientes
-        if len(ventas_recientes) >= 7:
-            feature_dict['media_movil_7'] = np.mean(ventas_recientes[-7:])
-        else:
-            feature_dict['media_movil_7'] = media_movil_7_hist
-        
-        if len(ventas_recientes) >= 14:
-            feature_dict['media_movil_14'] = np.mean(ventas_recientes[-14:])
-        else:
-            feature_dict['media_movil_14'] = media_movil_14_hist
-        
-        if len(ventas_recientes) >= 30:
-            feature_dict['media_movil_30'] = np.mean(ventas_recientes[-30:])
-        else:
-            feature_dict['media_movil_30'] = media_movil_30_hist
+        media_movil_7 = suma_7 / 70 if n_recientes >= 7 else media_movil_7_hist
+        media_movil_14 = suma_14 / 140 if n_recientes >= 14 else media_movil_14_hist
+        media_movil_30 = suma_30 / 300 if n_recientes >= 30 else media_movil_30_hist
         
         # Lag features (usar ventas de días anteriores)
-        feature_dict['lag_1'] = ventas_recientes[-1] if len(ventas_recientes) >= 1 else 0
-        feature_dict['lag_7'] = ventas_recientes[-7] if len(ventas_recientes) >= 7 else feature_dict['lag_1']
-        feature_dict['lag_14'] = ventas_recientes[-14] if len(ventas_recientes) >= 14 else feature_dict['lag_7']
+        lag_1 = ventas_recientes[-1] if n_recientes >= 1 else 0
+        lag_7 = ventas_recientes[-7] if n_recientes >= 7 else lag_1
+        lag_14 = ventas_recientes[-14] if n_recientes >= 14 else lag_7
         
-        # Desviación estándar móvil
-        if len(ventas_recientes) >= 7:
-            feature_dict['std_movil_7'] = np.std(ventas_recientes[-7:])
+        # Desviación estándar móvil (poblacional, como np.std)
+        if n_recientes >= 7:
+            std_movil_7 = math.sqrt(7 * suma_cuad_7 - suma_7 * suma_7) / 70
         else:
-            feature_dict['std_movil_7'] = std_movil_7_hist
-        
-        # Features de ingeniería avanzadas
-        if 'ratio_tendencia_7_30' in features:
-            feature_dict['ratio_tendencia_7_30'] = feature_dict['media_movil_7'] / (feature_dict['media_movil_30'] + 1e-8)
-        
-        if 'desviacion_lag1' in features:
-            feature_dict['desviacion_lag1'] = feature_dict['lag_1'] - feature_dict['media_movil_7']
-        
-        if 'coef_variacion' in features:
-            feature_dict['coef_variacion'] = feature_dict['std_movil_7'] / (feature_dict['media_movil_7'] + 1e-8)
-        
-        if 'fin_semana_mes' in features:
-            feature_dict['fin_semana_mes'] = feature_dict['es_fin_semana'] * feature_dict['mes']
-        
-        if 'tendencia_7_14' in features:
-            feature_dict['tendencia_7_14'] = feature_dict['media_movil_7'] - feature_dict['media_movil_14']
-        
-        if 'tendencia_14_30' in features:
-            feature_dict['tendencia_14_30'] = feature_dict['media_movil_14'] - feature_dict['media_movil_30']
-        
-        # Plato ID encoded
-        if plato_id and le_plato:
-            try:
-                feature_dict['plato_id_encoded'] = le_plato.transform([plato_id])[0]
-            except:
-                feature_dict['plato_id_encoded'] = 0
-        elif 'plato_id_encoded' in features:
-            feature_dict['plato_id_encoded'] = 0
+            std_movil_7 = std_movil_7_hist
+        
+        # Mismo orden que _FEATURES_AUTORREGRESIVAS
+        autorregresivas = (
+            media_movil_7, media_movil_14, media_movil_30,
+            lag_1, lag_7, lag_14, std_movil_7,
+            # Features de ingeniería avanzadas
+            media_movil_7 / (media_movil_30 + 1e-8),
+            lag_1 - media_movil_7,
+            std_movil_7 / (media_movil_7 + 1e-8),
+            media_movil_7 - media_movil_14,
+            media_movil_14 - media_movil_30,
+        )
+        fila = X_futuro_todos[i]
+        for k, j in columnas_autorregresivas:
+            fila[j] = autorregresivas[k]
         
-        # Crear array de features en el orden correcto
-        X_futuro = np.array([[feature_dict.get(f, 0) for f in features]])
+        X_futuro = X_futuro_todos[i:i + 1]
         
         # Aplicar scaler si existe
         if scaler:
             X_futuro = scaler.transform(X_futuro)
         
         # Predecir usando ensemble si está disponible
-        if usar_ensemble and len(modelos_ensemble) > 1:
-            pred_rf = modelos_ensemble[0].predict(X_futuro)[0]
-            pred_gb = modelos_ensemble[1].predict(X_futuro)[0]
+        if usar_ensemble:
+            pred_rf = _predecir_modelo(modelos_ensemble[0], X_futuro)[0]
+            pred_gb = _predecir_modelo(modelos_ensemble[1], X_futuro)[0]
             ventas_predichas = 0.7 * pred_rf + 0.3 * pred_gb
         else:
-            ventas_predichas = modelos_ensemble[0].predict(X_futuro)[0]
+            ventas_predichas = _predecir_modelo(modelos_ensemble[0], X_futuro)[0]
         
         ventas_predichas = max(0, round(ventas_predichas, 1))  # No puede ser negativo
-        
-        # Actualizar ventas_recientes para la siguiente iteración (simular predicción)
+        ventas_predichas_dias.append(ventas_predichas)
+        
+        # Actualizar ventas_recientes para la siguiente iteración (simular predicción):
+        # cada suma gana el día predicho y pierde el que sale de su ventana
+        nueva = round(ventas_predichas * 10)
+        saliente_7 = decimas[-7] if n_recientes >= 7 else 0
+        suma_7 += nueva - saliente_7
+        suma_cuad_7 += nueva * nueva - saliente_7 * saliente_7
+        suma_14 += nueva - (decimas[-14] if n_recientes >= 14 else 0)
+        suma_30 += nueva - (decimas[0] if n_recientes >= 30 else 0)
         ventas_recientes.append(ventas_predichas)
-        if len(ventas_recientes) > 30:
-            ventas_recientes.pop(0)
-        
+        decimas.append(nueva)
+    
+    return ventas_predichas_dias, calendario['es_fin_semana']
+
+
+def predecir_ventas_futuras(plato_id: Optional[int] = None, dias_prediccion: int = 7, modelo_tipo: str = 'auto', dias_historia: int = 365) -> List[Dict]:
+    """
+    Predice ventas futuras usando modelos ML mejorados
+    Calcula features temporales avanzadas (medias móviles, lags) usando datos históricos
+    
+    Args:
+        plato_id: ID del plato (opcional)
+        dias_prediccion: Días a predecir
+        modelo_tipo: Tipo de modelo ML
+        dias_historia: Días de historia a usar para entrenar (default: 365)
+    """
+    resultado_entrenamiento = entrenar_modelo_ventas(plato_id=plato_id, modelo_tipo=modelo_tipo, dias_historia=dias_historia)
+    
+    if resultado_entrenamiento['modelo'] is None:
+        return []
+    
+    modelos_ensemble = resultado_entrenamiento.get('modelos_ensemble', [resultado_entrenamiento['modelo']])
+    modelos_ensemble = _compilar_modelos_ensemble(modelos_ensemble, plato_id, resultado_entrenamiento.get('modelo_tipo', modelo_tipo))
+    
+    # Últimas 30 ventas diarias: punto de partida de las medias móviles y lags
+    ventas_recientes = _obtener_ventas_recientes(resultado_entrenamiento, plato_id, dias_historia)
+    
+    if not ventas_recientes:
+        return []
+    
+    # Predecir los días siguientes a hoy
+    hoy = date.today()
+    ventas_predichas, es_fin_semana = _predecir_dias_futuros(
+        resultado_entrenamiento, modelos_ensemble, plato_id,
+        hoy + timedelta(days=1), dias_prediccion, ventas_recientes
+    )
+    
+    predicciones = []
+    for i in range(dias_prediccion):
+        fecha_futura = hoy + timedelta(days=i + 1)
         predicciones.append({
             'fecha': fecha_futura,
-            'ventas_predichas': ventas_predichas,
+            'ventas_predichas': ventas_predichas[i],
             'dia_semana': fecha_futura.strftime('%A'),
-            'es_fin_semana': feature_dict['es_fin_semana'] == 1
+            'es_fin_semana': bool(es_fin_semana[i])
         })
     
     return predicciones
@@ -1224,179 +1818,39 @@ def predecir_ventas_periodo(fecha_inicio: date, fecha_fin: date, plato_id: Optio
         }
     
     modelos_ensemble = resultado_entrenamiento.get('modelos_ensemble', [resultado_entrenamiento['modelo']])
-    usar_ensemble = resultado_entrenamiento.get('usar_ensemble', False)
-    features = resultado_entrenamiento['features']
-    scaler = resultado_entrenamiento.get('scaler')
-    le_plato = resultado_entrenamiento.get('label_encoder')
+    modelos_ensemble = _compilar_modelos_ensemble(modelos_ensemble, plato_id, resultado_entrenamiento.get('modelo_tipo', modelo_tipo))
     
-    # Obtener datos históricos recientes para calcular medias móviles y lags
-    df_historico = preparar_datos_ventas(plato_id=plato_id, dias_historia=dias_historia)
+    # Últimas 30 ventas diarias: punto de partida de las medias móviles y lags
+    ventas_recientes = _obtener_ventas_recientes(resultado_entrenamiento, plato_id, dias_historia)
     
-    if df_historico.empty:
+    if not ventas_recientes:
         return {
             'error': 'No hay datos históricos disponibles',
             'predicciones': [],
             'comparacion_anio_anterior': None
         }
     
-    # Obtener las últimas 30 filas para calcular features temporales
-    df_reciente = df_historico.tail(30).copy()
-    ventas_recientes = df_reciente['ventas'].values.tolist()
-    
-    # Calcular medias móviles históricas
-    media_movil_7_hist = np.mean(ventas_recientes[-7:]) if len(ventas_recientes) >= 7 else np.mean(ventas_recientes) if ventas_recientes else 0
-    media_movil_14_hist = np.mean(ventas_recientes[-14:]) if len(ventas_recientes) >= 14 else np.mean(ventas_recientes) if ventas_recientes else 0
-    media_movil_30_hist = np.mean(ventas_recientes[-30:]) if len(ventas_recientes) >= 30 else np.mean(ventas_recientes) if ventas_recientes else 0
-    std_movil_7_hist = np.std(ventas_recientes[-7:]) if len(ventas_recientes) >= 7 else 0
-    
     # Generar predicciones para cada día del período
+    dias_periodo = (fecha_fin - fecha_inicio).days + 1
+    ventas_predichas, es_fin_semana = _predecir_dias_futuros(
+        resultado_entrenamiento, modelos_ensemble, plato_id,
+        fecha_inicio, dias_periodo, ventas_recientes
+    )
+    
+    dias_semana_es = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
     predicciones = []
-    fecha_actual = fecha_inicio
     total_predicho = 0
     
-    while fecha_actual <= fecha_fin:
-        # Preparar features básicas temporales
-        feature_dict = {
-            'dia_semana': fecha_actual.weekday(),
-            'mes': fecha_actual.month,
-            'año': fecha_actual.year,
-            'dia_mes': fecha_actual.day,
-            'semana_año': fecha_actual.isocalendar()[1],
-            'trimestre': (fecha_actual.month - 1) // 3 + 1,
-            'dia_año': fecha_actual.timetuple().tm_yday,
-            'es_fin_semana': 1 if fecha_actual.weekday() >= 5 else 0,
-            'es_inicio_mes': 1 if fecha_actual.day <= 7 else 0,
-            'es_mitad_mes': 1 if 14 <= fecha_actual.day <= 16 else 0,
-            'es_fin_mes': 1 if fecha_actual.day >= 25 else 0,
-            'es_lunes': 1 if fecha_actual.weekday() == 0 else 0,
-            'es_viernes': 1 if fecha_actual.weekday() == 4 else 0,
-        }
-        
-        # Features cíclicas
-        feature_dict['dia_semana_sin'] = np.sin(2 * np.pi * feature_dict['dia_semana'] / 7)
-        feature_dict['dia_semana_cos'] = np.cos(2 * np.pi * feature_dict['dia_semana'] / 7)
-        feature_dict['mes_sin'] = np.sin(2 * np.pi * feature_dict['mes'] / 12)
-        feature_dict['mes_cos'] = np.cos(2 * np.pi * feature_dict['mes'] / 12)
-        feature_dict['dia_mes_sin'] = np.sin(2 * np.pi * feature_dict['dia_mes'] / 31)
-        feature_dict['dia_mes_cos'] = np.cos(2 * np.pi * feature_dict['dia_mes'] / 31)
-        feature_dict['trimestre_sin'] = np.sin(2 * np.pi * feature_dict['trimestre'] / 4)
-        feature_dict['trimestre_cos'] = np.cos(2 * np.pi * feature_dict['trimestre'] / 4)
-        feature_dict['dia_año_sin'] = np.sin(2 * np.pi * feature_dict['dia_año'] / 365.25)
-        feature_dict['dia_año_cos'] = np.cos(2 * np.pi * feature_dict['dia_año'] / 365.25)
-        
-        # Features de calendario: Feriados
-        feriados_año = _obtener_feriados_chile(fecha_actual.year)
-        feature_dict['es_feriado'] = 1 if fecha_actual in feriados_año else 0
-        
-        # Features de calendario: Día de pago
-        feature_dict['es_dia_pago'] = 1 if (fecha_actual.day in [5, 10, 15, 20, 25] or fecha_actual.day >= 28) else 0
-        
-        # Días desde/hasta feriado
-        feriados_cercanos = [f for f in feriados_año if abs((f - fecha_actual).days) <= 7]
-        if feriados_cercanos:
-            dias_dif = [(f - fecha_actual).days for f in feriados_cercanos]
-            dias_desde = min([d for d in dias_dif if d >= 0], default=7)
-            dias_hasta = min([abs(d) for d in dias_dif if d < 0], default=7)
-            feature_dict['dias_desde_feriado'] = dias_desde if dias_desde != 7 else 7
-            feature_dict['dias_hasta_feriado'] = dias_hasta if dias_hasta != 7 else 7
-        else:
-            feature_dict['dias_desde_feriado'] = 7
-            feature_dict['dias_hasta_feriado'] = 7
-        
-        feature_dict['cerca_feriado'] = 1 if (feature_dict['dias_desde_feriado'] <= 2 or feature_dict['dias_hasta_feriado'] <= 2) else 0
-        
-        # Estacionalidad
-        feature_dict['es_verano'] = 1 if fecha_actual.month in [12, 1, 2] else 0
-        feature_dict['es_invierno'] = 1 if fecha_actual.month in [6, 7, 8] else 0
-        feature_dict['es_temporada_alta'] = 1 if fecha_actual.month in [12, 1, 2, 7, 8] else 0
-        
-        # Calcular medias móviles usando ventas recientes
-        if len(ventas_recientes) >= 7:
-            feature_dict['media_movil_7'] = np.mean(ventas_recientes[-7:])
-        else:
-            feature_dict['media_movil_7'] = media_movil_7_hist
-        
-        if len(ventas_recientes) >= 14:
-            feature_dict['media_movil_14'] = np.mean(ventas_recientes[-14:])
-        else:
-            feature_dict['media_movil_14'] = media_movil_14_hist
-        
-        if len(ventas_recientes) >= 30:
-            feature_dict['media_movil_30'] = np.mean(ventas_recientes[-30:])
-        else:
-            feature_dict['media_movil_30'] = media_movil_30_hist
-        
-        # Lag features (usar ventas de días anteriores)
-        feature_dict['lag_1'] = ventas_recientes[-1] if len(ventas_recientes) >= 1 else 0
-        feature_dict['lag_7'] = ventas_recientes[-7] if len(ventas_recientes) >= 7 else feature_dict['lag_1']
-        feature_dict['lag_14'] = ventas_recientes[-14] if len(ventas_recientes) >= 14 else feature_dict['lag_7']
-        
-        # Desviación estándar móvil
-        if len(ventas_recientes) >= 7:
-            feature_dict['std_movil_7'] = np.std(ventas_recientes[-7:])
-        else:
-            feature_dict['std_movil_7'] = std_movil_7_hist
-        
-        # Features de ingeniería avanzadas
-        if 'ratio_tendencia_7_30' in features:
-            feature_dict['ratio_tendencia_7_30'] = feature_dict['media_movil_7'] / (feature_dict['media_movil_30'] + 1e-8)
-        
-        if 'desviacion_lag1' in features:
-            feature_dict['desviacion_lag1'] = feature_dict['lag_1'] - feature_dict['media_movil_7']
-        
-        if 'coef_variacion' in features:
-            feature_dict['coef_variacion'] = feature_dict['std_movil_7'] / (feature_dict['media_movil_7'] + 1e-8)
-        
-        if 'fin_semana_mes' in features:
-            feature_dict['fin_semana_mes'] = feature_dict['es_fin_semana'] * feature_dict['mes']
-        
-        if 'tendencia_7_14' in features:
-            feature_dict['tendencia_7_14'] = feature_dict['media_movil_7'] - feature_dict['media_movil_14']
-        
-        if 'tendencia_14_30' in features:
-            feature_dict['tendencia_14_30'] = feature_dict['media_movil_14'] - feature_dict['media_movil_30']
-        
-        # Plato ID encoded
-        if plato_id and le_plato:
-            try:
-                feature_dict['plato_id_encoded'] = le_plato.transform([plato_id])[0]
-            except:
-                feature_dict['plato_id_encoded'] = 0
-        elif 'plato_id_encoded' in features:
-            feature_dict['plato_id_encoded'] = 0
-        
-        # Crear array de features en el orden correcto
-        X_futuro = np.array([[feature_dict.get(f, 0) for f in features]])
-        
-        # Aplicar scaler si existe
-        if scaler:
-            X_futuro = scaler.transform(X_futuro)
-        
-        # Predecir usando ensemble si está disponible
-        if usar_ensemble and len(modelos_ensemble) > 1:
-            pred_rf = modelos_ensemble[0].predict(X_futuro)[0]
-            pred_gb = modelos_ensemble[1].predict(X_futuro)[0]
-            ventas_predichas = 0.7 * pred_rf + 0.3 * pred_gb
-        else:
-            ventas_predichas = modelos_ensemble[0].predict(X_futuro)[0]
-        
-        ventas_predichas = max(0, round(ventas_predichas, 1))
-        total_predicho += ventas_predichas
-        
-        # Actualizar ventas_recientes para la siguiente iteración (simular predicción)
-        ventas_recientes.append(ventas_predichas)
-        if len(ventas_recientes) > 30:
-            ventas_recientes.pop(0)
-        
+    for i in range(dias_periodo):
+        fecha_actual = fecha_inicio + timedelta(days=i)
+        total_predicho += ventas_predichas[i]
         predicciones.append({
             'fecha': fecha_actual,
-            'ventas_predichas': ventas_predichas,
+            'ventas_predichas': ventas_predichas[i],
             'dia_semana': fecha_actual.strftime('%A'),
-            'dia_semana_es': ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo'][fecha_actual.weekday()],
-            'es_fin_semana': feature_dict['es_fin_semana'] == 1
+            'dia_semana_es': dias_semana_es[fecha_actual.weekday()],
+            'es_fin_semana': bool(es_fin_semana[i])
         })
-        
-        fecha_actual += timedelta(days=1)
     
     # Obtener ventas del año anterior para comparación
     ventas_anio_anterior = obtener_ventas_periodo_anterior(fecha_inicio, fecha_fin, plato_id)
@@ -1407,7 +1861,6 @@ def predecir_ventas_periodo(fecha_inicio: date, fecha_fin: date, plato_id: Optio
     if ventas_anio_anterior['total_ventas'] > 0:
         diferencia_porcentual = (diferencia_absoluta / ventas_anio_anterior['total_ventas']) * 100
     
-    dias_periodo = (fecha_fin - fecha_inicio).days + 1
     promedio_diario_predicho = total_predicho / dias_periodo if dias_periodo > 0 else 0
     
     return {
@@ -1528,7 +1981,7 @@ def predecir_demanda_insumo(insumo_id: int, dias_prediccion: int = 30, nivel_dat
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     
     # Entrenar modelo
-    modelo = RandomForestRegressor(n_estimators=50, max_depth=8, random_state=42, n_jobs=-1)
+    modelo = RandomForestRegressor(n_estimators=50, max_depth=8, random_state=42, n_jobs=_N_JOBS)
     modelo.fit(X_train, y_train)
     
     # Calcular promedio diario histórico
@@ -1648,7 +2101,7 @@ def predecir_mermas_futuras(dias_prediccion: int = 30) -> Dict:
     else:
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     
-    modelo = RandomForestRegressor(n_estimators=50, max_depth=8, random_state=42, n_jobs=-1)
+    modelo = RandomForestRegressor(n_estimators=50, max_depth=8, random_state=42, n_jobs=_N_JOBS)
     modelo.fit(X_train, y_train)
     
     # Predecir
@@ -1715,7 +2168,7 @@ def detectar_anomalias_ml_ventas(dias_analisis: int = 60) -> List[Dict]:
     X = df_diario[features].values
     
     # Entrenar Isolation Forest
-    iso_forest = IsolationForest(contamination=0.1, random_state=42, n_jobs=-1)
+    iso_forest = IsolationForest(contamination=0.1, random_state=42, n_jobs=_N_JOBS)
     anomalias = iso_forest.fit_predict(X)
     
     # Filtrar anomalías (etiqueta -1)
@@ -1764,7 +2217,7 @@ def detectar_anomalias_ml_mermas(dias_analisis: int = 60) -> List[Dict]:
         return []
     
     X_alto = df_alto[features].values
-    iso_forest = IsolationForest(contamination=0.15, random_state=42, n_jobs=-1)
+    iso_forest = IsolationForest(contamination=0.15, random_state=42, n_jobs=_N_JOBS)
     anomalias = iso_forest.fit_predict(X_alto)
     
     anomalias_detectadas = []
@@ -1,3 +1,71 @@
-from django.test import TestCase
+from datetime import date
+from itertools import cycle
 
-# Create your tests here.
+import numpy as np
+from django.test import SimpleTestCase
+
+from .ml_models import _FEATURES_AUTORREGRESIVAS, _predecir_dias_futuros
+
+
+class _ModeloRegistrador:
+    """
+    Modelo de prueba: guarda cada fila recibida y predice valores de una secuencia fija
+    """
+    def __init__(self, valores):
+        self.filas = []
+        self._valores = cycle(valores)
+
+    def predict(self, X):
+        self.filas.append(np.array(X[0]))
+        return np.array([next(self._valores)])
+
+
+def _features_esperadas(iniciales, historia):
+    """
+    Features autorregresivas recalculadas directamente con np.mean/np.std sobre la historia
+    (mientras falten días se usan los mismos respaldos que _predecir_dias_futuros)
+    """
+    n = len(historia)
+
+    def media(k):
+        return np.mean(historia[-k:]) if n >= k else np.mean(iniciales[-k:])
+
+    media_7, media_14, media_30 = media(7), media(14), media(30)
+    lag_1 = historia[-1]
+    lag_7 = historia[-7] if n >= 7 else lag_1
+    lag_14 = historia[-14] if n >= 14 else lag_7
+    std_7 = np.std(historia[-7:]) if n >= 7 else 0
+    return [
+        media_7, media_14, media_30, lag_1, lag_7, lag_14, std_7,
+        media_7 / (media_30 + 1e-8), lag_1 - media_7, std_7 / (media_7 + 1e-8),
+        media_7 - media_14, media_14 - media_30,
+    ]
+
+
+class PredecirDiasFuturosTest(SimpleTestCase):
+    """
+    Las sumas móviles en décimas enteras deben coincidir con recalcular cada ventana
+    """
+    PREDICCIONES = [3.7, 0.0, 12.3, 5.5, 8.1, 1.2, 20.0, 4.4, 6.6]
+
+    def _verificar(self, iniciales, n_dias=40):
+        modelo = _ModeloRegistrador(self.PREDICCIONES)
+        resultado = {'features': list(_FEATURES_AUTORREGRESIVAS), 'scaler': None, 'label_encoder': None}
+        predichas, _ = _predecir_dias_futuros(resultado, [modelo], None, date(2025, 3, 1), n_dias, list(iniciales))
+
+        self.assertEqual(predichas, [self.PREDICCIONES[i % len(self.PREDICCIONES)] for i in range(n_dias)])
+        historia = list(iniciales)
+        for i, fila in enumerate(modelo.filas):
+            np.testing.assert_allclose(fila, _features_esperadas(iniciales, historia), rtol=1e-9, atol=1e-9,
+                                       err_msg=f'día {i} con {len(iniciales)} ventas iniciales')
+            historia.append(predichas[i])
+
+    def test_historia_menor_a_7_dias(self):
+        self._verificar([4, 0, 7])
+
+    def test_historia_entre_7_y_29_dias(self):
+        self._verificar([5, 3, 9, 0, 2, 6, 4, 11, 1, 8])
+
+    def test_historia_de_30_o_mas_dias(self):
+        self._verificar([(i * 7) % 13 for i in range(30)])
+        self._verificar([(i * 5) % 17 for i in range(45)])
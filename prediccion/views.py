@@ -564,10 +564,11 @@ def reentrenar_modelo(request):
             messages.warning(request, 'Parámetros inválidos. Usando valores por defecto.')
         
         try:
-            from .ml_models import entrenar_modelo_ventas, eliminar_modelo_guardado
+            from .ml_models import entrenar_modelo_ventas, eliminar_modelo_guardado, resolver_modelo_tipo
             
             # Eliminar modelo guardado para forzar reentrenamiento
-            eliminar_modelo_guardado(plato_id_int, modelo_tipo)
+            # ('auto' se guarda con el tipo que resuelve, no como '_auto')
+            eliminar_modelo_guardado(plato_id_int, resolver_modelo_tipo(modelo_tipo))
             
             # Entrenar el modelo (forzar reentrenamiento)
             resultado = entrenar_modelo_ventas(